@@ -1,8 +1,27 @@
-from django_filters.rest_framework import (AllValuesMultipleFilter,
-                                           BooleanFilter, CharFilter,
+from django.db.models import Exists, OuterRef
+from django.forms import MultipleChoiceField
+from django_filters.rest_framework import (BooleanFilter, CharFilter, Filter,
                                            FilterSet, NumberFilter)
 from recipe.models import Ingredient, Recipe
 
+from .search import search_recipes
+
+
+class MultipleValueField(MultipleChoiceField):
+    """Поле со списком значений без перечня допустимых вариантов."""
+
+    def valid_value(self, value):
+        return True
+
+
+class MultipleValueFilter(Filter):
+    """
+    Фильтр по нескольким значениям параметра ("?tags=a&tags=b").
+    В отличие от AllValuesMultipleFilter не запрашивает из базы все
+    возможные значения для построения вариантов выбора.
+    """
+    field_class = MultipleValueField
+
 
 class IngredientFilter(FilterSet):
     """
@@ -23,7 +42,12 @@ class RecipeFilter(FilterSet):
     - в избранном у текущего пользователя;
     - в корзине у текущего пользователя;
     - автор;
-    - множественный фильтр по наличию тегов.
+    - множественный фильтр по наличию тегов;
+    - полнотекстовый поиск по названию и описанию ("search"), результаты
+      сортируются по релевантности.
+    Все отборы применяются к переданному queryset через EXISTS, поэтому
+    сочетаются друг с другом, не дублируют рецепты и выполняются одним
+    запросом.
     """
     is_favorited = BooleanFilter(
         method='get_is_favorited',
@@ -35,22 +59,54 @@ class RecipeFilter(FilterSet):
         field_name='author__id',
         lookup_expr='exact'
     )
-    #  по фильтрам тегов чето я не понял вроде все работает норм
-    tags = AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = MultipleValueFilter(
+        method='get_tags',
+    )
+    search = CharFilter(
+        method='get_search',
     )
 
+    def get_tags(self, queryset, name, value):
+        """Функция фильтра по наличию хотя бы одного из тегов (по slug)."""
+        if not value:
+            return queryset
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe_id=OuterRef('pk'),
+                tag__slug__in=value
+            )
+        ))
+
+    def _user_relation(self, queryset, through, value):
+        """Отбор рецептов, связанных с текущим пользователем через through."""
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(
+            through.objects.filter(
+                recipe_id=OuterRef('pk'),
+                foodgramuser_id=user.id
+            )
+        ))
+
     def get_is_favorited(self, queryset, name, value):
         """Функция фильтра по наличию в избранном у текущего пользователя"""
-        if value:
-            return Recipe.objects.filter(favorite=self.request.user)
-        return Recipe.objects.all()
+        return self._user_relation(queryset, Recipe.favorite.through, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         """Функция фильтра по наличию в корзине у текущего пользователя"""
-        if value:
-            return Recipe.objects.filter(shopping_cart=self.request.user)
-        return Recipe.objects.all()
+        return self._user_relation(
+            queryset, Recipe.shopping_cart.through, value
+        )
+
+    def get_search(self, queryset, name, value):
+        """Функция полнотекстового поиска по названию и описанию."""
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value)
 
     class Meta:
         model = Recipe
@@ -58,5 +114,6 @@ class RecipeFilter(FilterSet):
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'tags'
+            'tags',
+            'search'
         )
@@ -0,0 +1,218 @@
+"""
+Хранение и уменьшенные копии изображений рецептов.
+
+Загруженные изображения хранятся по адресу от содержимого:
+recipe_images/<первые 2 символа>/<sha256>.<расширение>. Одинаковые
+изображения записываются один раз и используются несколькими рецептами;
+число ссылок на файл - число рецептов с таким Recipe.image (поле
+проиндексировано). Файлы при удалении рецепта или замене изображения
+сразу не удаляются: одновременная загрузка такого же изображения может
+сослаться на файл, пока её транзакция не зафиксирована. Файлы без ссылок
+старше --min-age удаляет команда "python manage.py dedup_images"; при
+повторном использовании время изменения файла обновляется, поэтому
+команда не удалит его, пока рецепт сохраняется.
+
+Варианты из settings.IMAGE_VARIANTS (миниатюры в JPEG и WebP, копия в
+WebP) строятся после фиксации транзакции пулом потоков внутри процесса,
+как списки покупок (см. jobs), и тоже общие для одинаковых изображений.
+Пути вариантов записываются в Recipe.image_variants вместе с именем
+исходного файла: варианты отдаются, только пока оно совпадает с
+Recipe.image, поэтому после замены изображения до новой обработки
+отдаётся оригинал. Рецепты без вариантов обрабатывает команда
+"python manage.py image_variants".
+
+Размер изображения в пикселях проверяется по заголовку, до декодирования,
+поэтому подобранный файл не может занять всю память воркера.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from hashlib import sha256
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+from recipe.models import Recipe
+
+from .utils import reference_version_bump
+
+IMAGES_DIR = 'recipe_images'
+VARIANTS_DIR = f'{IMAGES_DIR}/variants'
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants'
+)
+
+
+def image_too_large(width: int, height: int) -> bool:
+    """Превышает ли изображение settings.IMAGE_MAX_PIXELS."""
+    return width * height > settings.IMAGE_MAX_PIXELS
+
+
+def variant_name(source: str, variant: str, image_format: str) -> str:
+    """Имя файла варианта в хранилище - по имени оригинала."""
+    stem = PurePosixPath(source).stem
+    return f'{VARIANTS_DIR}/{stem}_{variant}.{EXTENSIONS[image_format]}'
+
+
+def variant_names(source: str) -> list:
+    """Имена файлов всех вариантов изображения source."""
+    return [
+        variant_name(source, variant, image_format)
+        for variant, (image_format, _) in settings.IMAGE_VARIANTS.items()
+    ]
+
+
+def content_name(file, extension: str) -> str:
+    """Имя файла в хранилище по SHA-256 содержимого."""
+    digest = sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    return f'{IMAGES_DIR}/{digest[:2]}/{digest}.{extension.lower()}'
+
+
+def store_recipe_image(file) -> str:
+    """
+    Сохраняет загруженное изображение по адресу от содержимого и
+    возвращает имя файла. Если такое изображение уже есть, оно не
+    записывается повторно.
+    """
+    name = content_name(file, PurePosixPath(file.name).suffix.lstrip('.'))
+    if touch_image(name):
+        return name
+    file.seek(0)
+    return default_storage.save(name, file)
+
+
+def touch_image(name: str) -> bool:
+    """
+    Обновляет время изменения изображения и его вариантов, чтобы команда
+    dedup_images не удалила их, пока рецепт с этим изображением
+    сохраняется. Возвращает, есть ли изображение в хранилище.
+    """
+    with suppress(NotImplementedError):
+        for file_name in (name, *variant_names(name)):
+            with suppress(FileNotFoundError):
+                os.utime(default_storage.path(file_name))
+    return default_storage.exists(name)
+
+
+def delete_image(name: str) -> None:
+    """Удаляет файл изображения и его варианты из хранилища."""
+    for file_name in (name, *variant_names(name)):
+        default_storage.delete(file_name)
+
+
+def resized(image, width: int, image_format: str):
+    """
+    Копия изображения шириной не больше width с сохранением пропорций.
+    JPEG не поддерживает прозрачность - она заменяется белым фоном.
+    """
+    image = image.copy()
+    image.thumbnail((width, image.height), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image
+
+
+def build_image_variants(source: str, rebuild: bool = False) -> dict:
+    """
+    Строит варианты изображения source (имя файла в хранилище) и
+    возвращает словарь {вариант: имя файла}. Имена вариантов зависят только
+    от source, поэтому уже построенные варианты используются повторно, если
+    не передан rebuild.
+    """
+    names = dict(zip(settings.IMAGE_VARIANTS, variant_names(source)))
+    if not rebuild and all(map(default_storage.exists, names.values())):
+        return names
+    widest = max(width for _, width in settings.IMAGE_VARIANTS.values())
+    with default_storage.open(source) as file:
+        image = Image.open(file)
+        if image_too_large(*image.size):
+            raise ValueError(
+                f'Изображение больше {settings.IMAGE_MAX_PIXELS} пикселей.'
+            )
+        # Для JPEG декодируется сразу уменьшенная копия.
+        image.draft('RGB', (widest, widest * image.height // image.width))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert(
+            'RGBA' if 'A' in image.getbands() or 'transparency' in image.info
+            else 'RGB'
+        )
+    files = {}
+    for variant, (image_format, width) in settings.IMAGE_VARIANTS.items():
+        buffer = BytesIO()
+        resized(image, width, image_format).save(
+            buffer,
+            image_format,
+            quality=settings.IMAGE_VARIANT_QUALITY,
+            optimize=True
+        )
+        name = names[variant]
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        files[variant] = default_storage.save(
+            name, ContentFile(buffer.getvalue())
+        )
+    return files
+
+
+def process_recipe_image(source: str, rebuild: bool = False) -> bool:
+    """
+    Строит варианты изображения и записывает их во все рецепты с этим
+    изображением. Ошибка обработки тоже записывается - рецепты продолжат
+    отдавать оригинал.
+    """
+    variants = {'source': source, 'files': {}}
+    try:
+        variants['files'] = build_image_variants(source, rebuild)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        variants['error'] = str(error)
+    updated = Recipe.objects.filter(image=source).update(
+        image_variants=variants,
+        version=F('version') + 1
+    )
+    if updated:
+        reference_version_bump('recipe')
+    return 'error' not in variants
+
+
+def run_recipe_image(source: str) -> None:
+    """Задача пула: обработка изображения в отдельном потоке."""
+    close_old_connections()
+    try:
+        process_recipe_image(source)
+    finally:
+        close_old_connections()
+
+
+def enqueue_recipe_image(recipe) -> None:
+    """Ставит изображение рецепта в очередь после фиксации транзакции."""
+    source = recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(run_recipe_image, source)
+    )
+
+
+def image_variants(recipe) -> dict:
+    """Готовые варианты текущего изображения рецепта: {вариант: файл}."""
+    variants = recipe.image_variants or {}
+    if not recipe.image or variants.get('source') != recipe.image.name:
+        return {}
+    return variants.get('files', {})
+
+
+def image_url(request, name: str) -> str:
+    """Абсолютный URL файла из хранилища, как у ImageField в DRF."""
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,68 @@
+"""
+Фоновое формирование файлов со списком покупок.
+
+Задачи выполняются пулом потоков внутри процесса приложения, внешний брокер
+не нужен. Состояние задачи и готовый файл хранятся в базе (ShoppingListJob),
+поэтому опрашивать задачу и забирать файл можно через любой воркер.
+Если процесс перезапустится до завершения задачи, она останется в статусе
+"pending"/"running" - клиенту достаточно создать новую.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from recipe.models import ShoppingListJob
+
+from .utils import shopping_list_content
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.SHOPPING_LIST_JOB_WORKERS,
+    thread_name_prefix='shopping-list'
+)
+
+
+def run_shopping_list_job(job_id: int) -> None:
+    """
+    Формирует файл для задачи и сохраняет результат в неё.
+    При любой ошибке задача помечается как "failed", чтобы клиент не
+    опрашивал её бесконечно.
+    """
+    close_old_connections()
+    try:
+        ShoppingListJob.objects.filter(id=job_id).update(
+            status=ShoppingListJob.Status.RUNNING
+        )
+        job = ShoppingListJob.objects.select_related('user').get(id=job_id)
+        content = shopping_list_content(job.user, job.file_format)
+        ShoppingListJob.objects.filter(id=job_id).update(
+            status=ShoppingListJob.Status.DONE,
+            cart_version=job.user.cart_version,
+            content=content,
+            finished=timezone.now()
+        )
+    except Exception as error:
+        ShoppingListJob.objects.filter(id=job_id).update(
+            status=ShoppingListJob.Status.FAILED,
+            error=str(error) or type(error).__name__,
+            finished=timezone.now()
+        )
+    finally:
+        close_old_connections()
+
+
+def enqueue_shopping_list_job(user, file_format: str = 'pdf'):
+    """
+    Создаёт задачу и ставит её в очередь после фиксации транзакции.
+    Старые завершённые задачи пользователя сверх SHOPPING_LIST_JOB_KEEP
+    удаляются; задачи в очереди и выполняющиеся не трогаются.
+    """
+    job = ShoppingListJob.objects.create(user=user, file_format=file_format)
+    stale = user.shopping_list_jobs.filter(status__in=(
+        ShoppingListJob.Status.DONE, ShoppingListJob.Status.FAILED
+    )).values_list('id', flat=True)[settings.SHOPPING_LIST_JOB_KEEP:]
+    ShoppingListJob.objects.filter(id__in=list(stale)).delete()
+    transaction.on_commit(
+        lambda: executor.submit(run_shopping_list_job, job.id)
+    )
+    return job
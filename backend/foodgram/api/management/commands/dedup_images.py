@@ -0,0 +1,100 @@
+from datetime import timedelta
+from pathlib import PurePosixPath
+
+from api.images import (IMAGES_DIR, content_name, delete_image,
+                        process_recipe_image, variant_names)
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipe.models import Recipe
+
+
+def storage_files(path: str):
+    """Все файлы каталога хранилища, включая вложенные каталоги."""
+    try:
+        directories, files = default_storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for file_name in files:
+        yield f'{path}/{file_name}'
+    for directory in directories:
+        yield from storage_files(f'{path}/{directory}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит изображения рецептов на адреса от содержимого, объединяя '
+        'одинаковые, и удаляет файлы, на которые не ссылается ни один '
+        'рецепт. С --dry-run только показывает изменения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Ничего не менять, только показать.'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Не удалять файлы моложе стольких минут: они могут '
+                 'принадлежать рецепту, который ещё сохраняется.'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = self.move(dry_run)
+        deleted = self.collect_garbage(dry_run, options['min_age'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено изображений: {moved}, удалено файлов: {deleted}'
+        ))
+
+    def move(self, dry_run: bool) -> int:
+        """
+        Переносит изображения на адреса от содержимого; старые файлы и
+        их варианты удаляются.
+        """
+        names = Recipe.objects.exclude(image='').order_by('image').values_list(
+            'image', flat=True
+        ).distinct()
+        moved = 0
+        for name in list(names):
+            if not default_storage.exists(name):
+                self.stderr.write(f'{name}: файл не найден')
+                continue
+            with default_storage.open(name) as file:
+                target = content_name(
+                    file, PurePosixPath(name).suffix.lstrip('.')
+                )
+            if target == name:
+                continue
+            moved += 1
+            self.stdout.write(f'{name} -> {target}')
+            if dry_run:
+                continue
+            if not default_storage.exists(target):
+                with default_storage.open(name) as file:
+                    target = default_storage.save(target, file)
+            Recipe.objects.filter(image=name).update(image=target)
+            delete_image(name)
+            process_recipe_image(target)
+        return moved
+
+    def collect_garbage(self, dry_run: bool, min_age: int) -> int:
+        """Удаляет файлы изображений, на которые не ссылаются рецепты."""
+        referenced = set(
+            Recipe.objects.exclude(image='').values_list('image', flat=True)
+        )
+        keep = referenced.union(*map(variant_names, referenced))
+        threshold = timezone.now() - timedelta(minutes=min_age)
+        deleted = 0
+        for name in list(storage_files(IMAGES_DIR)):
+            if (name in keep
+                    or default_storage.get_modified_time(name) > threshold):
+                continue
+            deleted += 1
+            self.stdout.write(f'удалён {name}')
+            if not dry_run:
+                default_storage.delete(name)
+        return deleted
@@ -0,0 +1,36 @@
+from api.images import image_variants, process_recipe_image
+from django.core.management.base import BaseCommand
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные копии изображений рецептов, у которых их нет '
+        '(например, загруженных до появления обработки или через админку). '
+        'С --all перестраивает все.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Перестроить варианты всех изображений.'
+        )
+
+    def handle(self, *args, **options):
+        sources = {
+            recipe.image.name for recipe in Recipe.objects.only(
+                'id', 'image', 'image_variants'
+            )
+            if recipe.image
+            and (options['all'] or not image_variants(recipe))
+        }
+        failed = 0
+        for source in sorted(sources):
+            if not process_recipe_image(source, rebuild=options['all']):
+                failed += 1
+                self.stderr.write(f'{source}: ошибка обработки')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {len(sources) - failed}, '
+            f'ошибок: {failed}'
+        ))
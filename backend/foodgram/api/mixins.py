@@ -1,8 +1,278 @@
+import gzip
+import re
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+from django.http.response import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from recipe.models import User
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED)
 
+from .utils import (cart_version_bump, counter_update, feed_fanout_resume,
+                    feed_follow, feed_unfollow, reference_version)
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+class ReferenceCacheMixin:
+    """
+    Миксин для справочников, которые почти не меняются.
+    Ответы получают заголовки ETag и Last-Modified по версии справочника,
+    при совпадении возвращается 304. Полный список (без параметров запроса)
+    сериализуется один раз на версию и хранится в памяти процесса вместе со
+    сжатой gzip копией.
+    """
+
+    reference_name = None
+    _payload = None
+
+    def _reference_headers(self, response, reference):
+        response['ETag'] = self._etag(reference)
+        response['Last-Modified'] = http_date(reference.updated.timestamp())
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def _etag(self, reference):
+        return f'"{self.reference_name}-{reference.version}"'
+
+    def _conditional_response(self, request, reference):
+        return get_conditional_response(
+            request,
+            etag=self._etag(reference),
+            last_modified=int(reference.updated.timestamp())
+        )
+
+    def _get_payload(self, version):
+        """Сериализованный полный список и его сжатая копия."""
+        payload = type(self)._payload
+        if payload is None or payload[0] != version:
+            serializer = self.get_serializer(
+                self.filter_queryset(self.get_queryset()),
+                many=True
+            )
+            content = JSONRenderer().render(serializer.data)
+            payload = (version, content, gzip.compress(content))
+            type(self)._payload = payload
+        return payload
+
+    def list(self, request, *args, **kwargs):
+        if any(request.query_params.values()):
+            return super().list(request, *args, **kwargs)
+        reference = reference_version(self.reference_name)
+        response = self._conditional_response(request, reference)
+        if response is None:
+            _, content, compressed = self._get_payload(reference.version)
+            accept = request.headers.get('Accept-Encoding', '')
+            if ACCEPTS_GZIP.search(accept):
+                response = HttpResponse(
+                    compressed, content_type='application/json'
+                )
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(
+                    content, content_type='application/json'
+                )
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return self._reference_headers(response, reference)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Объект ищется до проверки версии: на несуществующий id - 404, а
+        # не 304.
+        instance = self.get_object()
+        reference = reference_version(self.reference_name)
+        response = self._conditional_response(request, reference)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return self._reference_headers(response, reference)
+
+
+class AnonymousCacheMixin:
+    """
+    Миксин кэширования ответов list/retrieve для анонимных пользователей.
+    Ключ записи - действие, id объекта, нормализованные параметры запроса и
+    номер поколения (версия ReferenceVersion с именем cache_generation).
+    Изменение данных увеличивает номер поколения, после чего старые записи
+    больше не читаются и вытесняются самим кэшем - угадывать TTL не нужно.
+    Бэкенд - кэш из CACHES с именем settings.RECIPE_CACHE (в памяти
+    процесса, файловый или любой другой). Счётчики попаданий и промахов
+    хранятся в том же кэше (см. cache_counters).
+    """
+
+    cache_generation = None
+
+    @classmethod
+    def _cache(cls):
+        return caches[settings.RECIPE_CACHE]
+
+    @classmethod
+    def _count(cls, name):
+        key = f'{cls.cache_generation}:{name}'
+        cache = cls._cache()
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Запись успели вытеснить между add и incr.
+            cache.set(key, 1, timeout=None)
+
+    @classmethod
+    def cache_counters(cls):
+        """Число попаданий и промахов кэша."""
+        cache = cls._cache()
+        return {
+            name: cache.get(f'{cls.cache_generation}:{name}', 0)
+            for name in ('hits', 'misses')
+        }
+
+    def _cache_key(self, request, generation):
+        params = sorted(
+            (key, sorted(values))
+            for key, values in request.query_params.lists()
+        )
+        raw = (
+            f'{request.get_host()}:{self.action}:{self.kwargs.get("pk")}:'
+            f'{params}'
+        )
+        return (
+            f'{self.cache_generation}:{generation}:'
+            f'{md5(raw.encode()).hexdigest()}'
+        )
+
+    def _cached(self, handler, request, *args, **kwargs):
+        if (not request.user.is_anonymous
+                or request.accepted_renderer.format != 'json'):
+            return handler(request, *args, **kwargs)
+        generation = reference_version(self.cache_generation).version
+        key = self._cache_key(request, generation)
+        cache = self._cache()
+        content = cache.get(key)
+        if content is not None:
+            self._count('hits')
+            status = 'HIT'
+        else:
+            self._count('misses')
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content)
+            status = 'MISS'
+        response = HttpResponse(content, content_type='application/json')
+        response['X-Cache'] = status
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+
+class FragmentCacheMixin:
+    """
+    Миксин для list/retrieve с кэшированием общей для всех пользователей
+    части каждого объекта.
+    Готовый словарь fragment_serializer_class хранится в кэше
+    settings.RECIPE_CACHE под ключом (id, version) объекта - поле version
+    модели должно меняться при любом изменении, влияющем на вывод. Страница
+    собирается одним get_many; сериализуются (с подгрузкой
+    get_fragment_prefetch) только отсутствующие в кэше объекты.
+    Персональные поля добавляет метод overlay.
+    """
+
+    fragment_prefix = None
+    fragment_serializer_class = None
+
+    def get_fragment_prefetch(self):
+        """Связанные объекты, нужные для сериализации фрагмента."""
+        return ()
+
+    def overlay(self, data, objects):
+        """Дополняет фрагменты персональными полями текущего пользователя."""
+        return data
+
+    def get_fragment_prefix(self):
+        """
+        Префикс ключей кэша. Переопределяется, если вывод объекта зависит
+        от действия.
+        """
+        return self.fragment_prefix
+
+    def _fragment_key(self, obj):
+        # Ссылки на изображения абсолютные, поэтому хост входит в ключ.
+        return (
+            f'{self.get_fragment_prefix()}:{obj.id}:{obj.version}:'
+            f'{self.request.get_host()}'
+        )
+
+    def get_fragments(self, objects):
+        """Фрагменты для объектов в том же порядке."""
+        cache = caches[settings.RECIPE_CACHE]
+        keys = [self._fragment_key(obj) for obj in objects]
+        fragments = cache.get_many(keys)
+        missing = [
+            (key, obj) for key, obj in zip(keys, objects)
+            if key not in fragments
+        ]
+        if missing:
+            missing_objects = [obj for _, obj in missing]
+            prefetch_related_objects(
+                missing_objects, *self.get_fragment_prefetch()
+            )
+            serializer = self.fragment_serializer_class(
+                missing_objects,
+                many=True,
+                context=self.get_serializer_context()
+            )
+            fresh = {
+                key: dict(data)
+                for (key, _), data in zip(missing, serializer.data)
+            }
+            cache.set_many(fresh)
+            fragments.update(fresh)
+        return self.overlay([fragments[key] for key in keys], objects)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_fragments(page))
+        return Response(self.get_fragments(list(queryset)))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_fragments([self.get_object()])[0])
+
+
+class SubscriptionsContextMixin:
+    """
+    Миксин добавляет в контекст сериализатора множество id пользователей
+    текущей страницы, на которых подписан текущий пользователь. Множество
+    загружается одним запросом на страницу.
+    """
+    page_user_ids = None
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.page_user_ids = [obj.id for obj in page]
+        return page
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated and self.page_user_ids is not None:
+            context['subscriptions'] = set(user.subscription.filter(
+                id__in=self.page_user_ids
+            ).values_list('id', flat=True))
+        return context
+
 
 class AddDelViewMixin:
     """
@@ -25,8 +295,14 @@ class AddDelViewMixin:
             'favorite': user.favorites,
             'shopping_cart': user.in_cart,
         }
+        counters = {
+            'subscribe': 'followers_count',
+            'favorite': 'favorites_count',
+            'shopping_cart': 'in_cart_count',
+        }
 
-        manager = managers[manager]
+        relation = manager
+        manager = managers[relation]
 
         obj = get_object_or_404(self.queryset, id=obj_id)
         serializer = self.add_serializer(
@@ -37,10 +313,25 @@ class AddDelViewMixin:
 
         if not exists and self.request.method in ('GET', 'POST'):
             manager.add(obj)
+            counter_update(
+                type(obj).objects.filter(id=obj.id), counters[relation], 1
+            )
+            if relation == 'shopping_cart':
+                cart_version_bump(User.objects.filter(id=user.id))
+            if relation == 'subscribe':
+                feed_follow(user, obj)
             return Response(serializer.data, status=HTTP_201_CREATED)
 
         if exists and self.request.method in ('DELETE', ):
             manager.remove(obj)
+            counter_update(
+                type(obj).objects.filter(id=obj.id), counters[relation], -1
+            )
+            if relation == 'shopping_cart':
+                cart_version_bump(User.objects.filter(id=user.id))
+            if relation == 'subscribe':
+                feed_unfollow(user, obj)
+                feed_fanout_resume(User.objects.filter(id=obj.id))
             return Response(status=HTTP_204_NO_CONTENT)
 
         return Response(status=HTTP_400_BAD_REQUEST)
@@ -1,5 +1,190 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from functools import reduce
+from operator import attrgetter, or_
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class PageLimitPagination(PageNumberPagination):
+    """
+    Постраничная пагинация "?page=&limit=".
+
+    Параметр "?cursor=" включает пагинацию по ключу: страница выбирается
+    условием по полям cursor_ordering вьюсета (например, "pub_date" и
+    "id"), без OFFSET и без COUNT(*), поэтому глубокие страницы отдаются так
+    же быстро, как первая. Общее количество объектов в этом режиме
+    считается только по запросу "?count=true". Если queryset отсортирован
+    иначе (например, по релевантности поиска "?search="), курсор
+    игнорируется и используется постраничная пагинация - порядок не
+    теряется.
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if (self.cursor_query_param not in request.query_params
+                or not ordering
+                or not self.keyset_ordering(queryset, ordering)):
+            self.ordering = None
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_keyset((queryset,), ordering, request)
+
+    def paginate_keyset(self, querysets, ordering, request) -> list:
+        """
+        Страница по ключу ordering из одного или нескольких queryset с
+        общими полями сортировки. Из каждого queryset читается не больше
+        page_size + 1 строк после позиции курсора, затем строки сливаются;
+        строки с одинаковым ключом считаются одним объектом.
+        """
+        self.ordering = ordering
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = sum(queryset.count() for queryset in querysets)
+
+        reverse, position = self.decode_cursor(request)
+        if reverse:
+            ordering = [self._invert(field) for field in ordering]
+        results = []
+        try:
+            for queryset in querysets:
+                queryset = queryset.order_by(*ordering)
+                if position is not None:
+                    queryset = queryset.filter(self.position_filter(
+                        ordering, position
+                    ))
+                results.extend(queryset[:self.page_size + 1])
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(querysets) > 1:
+            results = self._merge(results, ordering)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.results = results
+        return results
+
+    def get_paginated_response(self, data):
+        if self.ordering is None:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if self.ordering is None:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor(False, self.results[-1])
+
+    def get_previous_link(self):
+        if self.ordering is None:
+            return super().get_previous_link()
+        if not self.has_previous or not self.results:
+            return None
+        return self.encode_cursor(True, self.results[0])
+
+    def encode_cursor(self, reverse: bool, obj) -> str:
+        """Ссылка на страницу после (или перед) объектом obj."""
+        position = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        cursor = urlsafe_b64encode(
+            json.dumps([reverse, position]).encode()
+        ).decode()
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request) -> tuple:
+        """
+        Возвращает направление и позицию из параметра "cursor".
+        Пустой параметр означает первую страницу.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            reverse, position = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), position
+
+    @staticmethod
+    def _merge(results: list, ordering) -> list:
+        """Сортирует строки по ordering, убирая повторы ключа."""
+        names = [field.lstrip('-') for field in ordering]
+        unique = {}
+        for obj in results:
+            unique.setdefault(
+                tuple(getattr(obj, name) for name in names), obj
+            )
+        results = list(unique.values())
+        for field in reversed(ordering):
+            results.sort(
+                key=attrgetter(field.lstrip('-')),
+                reverse=field.startswith('-')
+            )
+        return results
+
+    @staticmethod
+    def keyset_ordering(queryset, ordering) -> bool:
+        """
+        Проверяет, что queryset не отсортирован явно по другим полям, чем
+        ordering: пагинация по ключу пересортировала бы его.
+        """
+        return (
+            not queryset.query.order_by
+            or tuple(queryset.query.order_by) == tuple(ordering)
+        )
+
+    @staticmethod
+    def _invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def position_filter(ordering, position) -> Q:
+        """
+        Условие "строка идёт после position" для сортировки ordering:
+        (a > x) OR (a = x AND b > y) ...
+        """
+        conditions = []
+        for number, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = {
+                previous.lstrip('-'): value
+                for previous, value in zip(ordering[:number], position)
+            }
+            condition[f'{name}__{lookup}'] = position[number]
+            conditions.append(Q(**condition))
+        return reduce(or_, conditions)
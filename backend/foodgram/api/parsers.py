@@ -0,0 +1,124 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import multipartparser
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import DataAndFiles, FormParser, MultiPartParser
+
+IMAGE_CONTENT_TYPES = (
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'image/webp',
+)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Сохраняет файлы из запроса во временные файлы на диске, не держа их в
+    памяти. Запрос отклоняется сразу, если Content-Length больше допустимого
+    или тип файла не изображение; файл - как только превысит
+    settings.IMAGE_MAX_BYTES, не дочитывая запрос.
+    """
+
+    def handle_raw_input(self, input_data, meta, content_length, boundary,
+                         encoding=None):
+        # Кроме файла в запросе есть остальные поля рецепта.
+        limit = settings.IMAGE_MAX_BYTES + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if content_length > limit:
+            raise ValidationError(
+                {'image': [f'Запрос больше {limit} байт.']}
+            )
+
+    def new_file(self, field_name, file_name, content_type, *args,
+                 **kwargs):
+        if content_type not in IMAGE_CONTENT_TYPES:
+            raise ValidationError(
+                {field_name: [f'Неподдерживаемый тип файла {content_type}.']}
+            )
+        self.received = 0
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_MAX_BYTES:
+            raise ValidationError({self.field_name: [
+                f'Размер изображения больше {settings.IMAGE_MAX_BYTES} байт.'
+            ]})
+        return super().receive_data_chunk(raw_data, start)
+
+
+class RecipeFormDataMixin:
+    """
+    Поля формы рецепта приводятся к виду, как после разбора JSON. Поля из
+    list_fields ("tags" и "ingredients") передаются повторяющимися полями
+    или JSON-списком; каждое значение, похожее на JSON, декодируется.
+    Остальные поля - строки.
+    """
+    list_fields = ('tags', 'ingredients')
+
+    def plain_data(self, data) -> dict:
+        """QueryDict формы -> словарь, как после разбора JSON."""
+        result = {}
+        for key, values in data.lists():
+            if key not in self.list_fields:
+                result[key] = values[-1]
+                continue
+            result[key] = []
+            for value in values:
+                if value.lstrip()[:1] not in ('[', '{'):
+                    result[key].append(value)
+                    continue
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    raise ParseError(f'Поле "{key}" - неверный JSON.')
+                if isinstance(value, list):
+                    result[key].extend(value)
+                else:
+                    result[key].append(value)
+        return result
+
+
+class RecipeFormParser(RecipeFormDataMixin, FormParser):
+    """
+    application/x-www-form-urlencoded для рецептов: изображение передаётся
+    строкой base64, как в JSON.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return self.plain_data(
+            super().parse(stream, media_type, parser_context)
+        )
+
+
+class RecipeMultiPartParser(RecipeFormDataMixin, MultiPartParser):
+    """
+    multipart/form-data для рецептов: изображение передаётся файлом, а не
+    строкой base64.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        try:
+            data, files = multipartparser.MultiPartParser(
+                meta,
+                stream,
+                [ImageUploadHandler(request._request)],
+                parser_context.get('encoding', settings.DEFAULT_CHARSET)
+            ).parse()
+        except multipartparser.MultiPartParserError as error:
+            raise ParseError(f'Multipart form parse error - {error}')
+        # DRF объединяет данные с файлами через update(), поэтому данные
+        # тоже MultiValueDict: по ключу отдаётся значение целиком.
+        return DataAndFiles(
+            MultiValueDict({
+                key: [value] for key, value in self.plain_data(data).items()
+            }),
+            files
+        )
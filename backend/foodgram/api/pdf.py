@@ -0,0 +1,199 @@
+"""
+Формирование pdf-файла со списком покупок.
+
+Шрифт урезается до нужных символов (латиница, кириллица, знаки препинания,
+включая типографские кавычки, тире и многоточие) один раз на процесс -
+каждый документ подключает уже маленький файл шрифта, а не разбирает
+полный arial.ttf. Строки таблицы раскладываются заранее: высота строки и
+переносы считаются до отрисовки (слова шире ячейки разбиваются по
+символам), поэтому переход на новую страницу проверяется один раз на
+строку. Ячейки рисуются рамкой и текстом без вызова cell() - это в разы
+дешевле на больших списках.
+Документ формируется в памяти за один проход, без записи на диск.
+"""
+import os
+from datetime import datetime as dt
+from functools import lru_cache
+from hashlib import md5
+from tempfile import gettempdir, mkstemp
+
+from fontTools import subset, ttLib
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+FONT_FAMILY = 'arial'
+FONT_PATH = './data/arial.ttf'
+FONT_SIZE = 13
+TABLE_HEADER = ('Ингредиент', 'Количество', 'Единицы измерения')
+FOOTER = 'Сформировано в продуктовом помощнике Foodgram'
+FONT_UNICODES = (
+    *range(0x0020, 0x007F),
+    *range(0x00A0, 0x0100),
+    *range(0x0400, 0x0460),
+    *range(0x2000, 0x2070),
+    0x2116,
+)
+
+
+@lru_cache(maxsize=None)
+def _subset_font(font_path: str) -> str:
+    """
+    Возвращает путь к урезанной копии шрифта.
+    Копия сохраняется во временный каталог и переиспользуется всеми
+    процессами; запись атомарная, поэтому воркеры и потоки не мешают друг
+    другу.
+    """
+    stat = os.stat(font_path)
+    key = md5(
+        f'{os.path.abspath(font_path)}:{stat.st_size}:{stat.st_mtime}:'
+        f'{FONT_UNICODES}'.encode()
+    ).hexdigest()
+    subset_path = os.path.join(gettempdir(), f'foodgram-{key}.ttf')
+    if os.path.exists(subset_path):
+        return subset_path
+
+    options = subset.Options()
+    options.layout_features = []
+    options.hinting = False
+    options.notdef_outline = True
+    font = ttLib.TTFont(font_path)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=FONT_UNICODES)
+    subsetter.subset(font)
+    descriptor, tmp_path = mkstemp(
+        dir=os.path.dirname(subset_path), suffix='.ttf'
+    )
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            font.save(file)
+        os.replace(tmp_path, subset_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return subset_path
+
+
+class ShoppingListPDF:
+    """Раскладка и отрисовка таблицы списка покупок."""
+
+    def __init__(self, font_path: str = FONT_PATH) -> None:
+        pdf = FPDF()
+        pdf.add_font(FONT_FAMILY, style='', fname=_subset_font(font_path))
+        pdf.set_auto_page_break(False)
+        pdf.set_font(FONT_FAMILY, size=FONT_SIZE)
+        self.pdf = pdf
+        self.col_width = pdf.epw / len(TABLE_HEADER)
+        self.text_width = self.col_width - 2 * pdf.c_margin
+        self.row_height = pdf.font_size * 2.5
+        self.line_height = pdf.font_size * 1.2
+        self.widths = {}
+
+    def _width(self, text: str) -> float:
+        """Ширина текста; единицы измерения и числа повторяются часто."""
+        if text in self.widths:
+            return self.widths[text]
+        self.widths[text] = self.pdf.get_string_width(text)
+        return self.widths[text]
+
+    def _split_word(self, word: str) -> list:
+        """
+        Разбивает слово шире ячейки на части по символам, как multi_cell;
+        слово, которое помещается, возвращается целиком.
+        """
+        if self._width(word) <= self.text_width:
+            return [word]
+        parts = []
+        part = ''
+        for char in word:
+            if part and (self.pdf.get_string_width(part + char)
+                         > self.text_width):
+                parts.append(part)
+                part = ''
+            part += char
+        parts.append(part)
+        return parts
+
+    def _wrap(self, text: str) -> list:
+        """Разбивает текст на строки, помещающиеся в ячейку."""
+        if self._width(text) <= self.text_width:
+            return [text]
+        lines = []
+        line = ''
+        for word in text.split():
+            for part in self._split_word(word):
+                candidate = f'{line} {part}' if line else part
+                if line and self._width(candidate) > self.text_width:
+                    lines.append(line)
+                    candidate = part
+                line = candidate
+        lines.append(line)
+        return lines
+
+    def _layout(self, cells: tuple) -> tuple:
+        """Возвращает переносы строк для каждой ячейки и высоту строки."""
+        lines = [self._wrap(cell) for cell in cells]
+        height = max(
+            self.row_height,
+            max(map(len, lines)) * self.line_height
+        )
+        return lines, height
+
+    def _row(self, lines: list, height: float) -> None:
+        """Рисует строку таблицы высотой height."""
+        pdf = self.pdf
+        x, y = pdf.l_margin, pdf.get_y()
+        for cell_lines in lines:
+            pdf.rect(x, y, self.col_width, height)
+            baseline = (
+                y + (height - len(cell_lines) * self.line_height) / 2
+                + (self.line_height + pdf.font_size) / 2 - pdf.font_size / 5
+            )
+            for text in cell_lines:
+                pdf.text(x + pdf.c_margin, baseline, text)
+                baseline += self.line_height
+            x += self.col_width
+        pdf.set_xy(pdf.l_margin, y + height)
+
+    def _page(self) -> None:
+        """Начинает новую страницу с заголовком таблицы."""
+        self.pdf.add_page()
+        self._row(*self._layout(TABLE_HEADER))
+
+    def render(self, first_name: str, ingredients) -> bytes:
+        """
+        Формирует файл со списком и количеством ингредиентов.
+        ingredients - итерируемый объект словарей с ключами
+        "ingredient", "sum_amount" и "measure".
+        """
+        pdf = self.pdf
+        create_time = dt.now().strftime('%d.%m.%Y %H:%M')
+        pdf.add_page()
+        for text in (
+            f'Список покупок пользователя: {first_name}', create_time
+        ):
+            pdf.cell(
+                200, 10, text, align='C',
+                new_x=XPos.LMARGIN, new_y=YPos.NEXT
+            )
+        self._row(*self._layout(TABLE_HEADER))
+
+        bottom = pdf.h - pdf.b_margin
+        for item in ingredients:
+            lines, height = self._layout((
+                item['ingredient'],
+                str(item['sum_amount']),
+                item['measure'],
+            ))
+            if pdf.get_y() + height > bottom:
+                self._page()
+            self._row(lines, height)
+
+        if pdf.get_y() + 10 > bottom:
+            pdf.add_page()
+        pdf.cell(200, 10, FOOTER, align='C')
+        return bytes(pdf.output())
+
+
+def render_shopping_list(user, ingredients, font_path: str = FONT_PATH):
+    """Возвращает содержимое pdf-файла со списком покупок пользователя."""
+    return ShoppingListPDF(font_path).render(user.first_name, ingredients)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class PlainTextRenderer(BaseRenderer):
+    """
+    Рендерер простого текста.
+    Нужен, чтобы DRF принимал параметр "?format=txt": сам файл отдаётся
+    готовым HttpResponse, рендерер используется только для ошибок.
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Рендерер для "?format=csv"."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(PlainTextRenderer):
+    """Рендерер для "?format=pdf"."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class FileFormatNegotiation(DefaultContentNegotiation):
+    """
+    Выбор формата ответа только по заголовку Accept.
+    Для запросов, где параметр "format" задаёт формат формируемого файла,
+    а не ответа (см. задачи на список покупок).
+    """
+    settings = SimpleNamespace(URL_FORMAT_OVERRIDE=None)
@@ -0,0 +1,224 @@
+"""
+Индексы для поиска ингредиентов в памяти процесса.
+
+Справочник ингредиентов небольшой (около 2000 строк) и меняется редко,
+поэтому поиск выполняется без запроса к базе:
+- по началу названия - по отсортированному списку названий в нижнем
+  регистре (str.casefold, корректно для кириллицы) с помощью bisect;
+- с опечатками и по середине названия - по инвертированному индексу
+  триграмм, как в pg_trgm. На PostgreSQL вместо него используется сам
+  pg_trgm с GIN-индексом (см. search_ingredients).
+
+Индексы перестраиваются, когда меняется версия справочника ингредиентов
+(ReferenceVersion "ingredient", её увеличивают сигналы): изменения видны
+всем процессам сразу, ценой одного запроса версии на поиск.
+
+Полнотекстовый поиск рецептов на PostgreSQL идёт по хранимому столбцу
+recipe_recipe.search_vector с GIN-индексом (см. миграцию
+recipe/0008_recipe_search_vector), на остальных СУБД - через icontains.
+"""
+import re
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connection
+from django.db.models import (BooleanField, Case, FloatField, Func, Q, Value,
+                              When)
+from django.db.models.expressions import RawSQL
+from recipe.models import Ingredient
+
+from .serializers import IngredientSerializer
+from .utils import reference_version
+
+WORD_RE = re.compile(r'\w+')
+
+
+def trigrams(text: str) -> set:
+    """
+    Множество триграмм строки по правилам pg_trgm: каждое слово в нижнем
+    регистре дополняется двумя пробелами слева и одним справа.
+    """
+    result = set()
+    for word in WORD_RE.findall(text.casefold()):
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class PrefixIndex:
+    """Поиск по началу названия без учёта регистра."""
+
+    def __init__(self, rows: list) -> None:
+        self.rows = sorted(
+            (row['name'].casefold(), row['name'], row['id'], row)
+            for row in rows
+        )
+        self.keys = [row[0] for row in self.rows]
+
+    def search(self, prefix: str) -> list:
+        """
+        Возвращает ингредиенты, название которых начинается с prefix,
+        в порядке сортировки по названию.
+        """
+        prefix = prefix.casefold()
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + chr(0x10FFFF), lo=start)
+        matches = sorted(
+            self.rows[start:end], key=lambda row: (row[1], row[2])
+        )
+        return [row[3] for row in matches]
+
+
+class TrigramIndex:
+    """
+    Инвертированный индекс триграмм: триграмма -> номера ингредиентов.
+    Ранг совпадения - доля триграмм запроса, найденных в названии (аналог
+    word_similarity из pg_trgm), при равенстве - сходство всего названия.
+    """
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self.sizes = []
+        self.postings = {}
+        for number, row in enumerate(rows):
+            grams = trigrams(row['name'])
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(number)
+
+    def search(self, query: str, limit: int, threshold: float) -> list:
+        """Возвращает до limit ингредиентов, похожих на query."""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        minimum = threshold * len(grams)
+        ranked = []
+        for number, count in shared.items():
+            if count < minimum:
+                continue
+            similarity = count / (len(grams) + self.sizes[number] - count)
+            ranked.append((
+                -count, -similarity, self.rows[number]['name'], number
+            ))
+        ranked.sort()
+        return [self.rows[item[3]] for item in ranked[:limit]]
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов, построенный из базы и хранящийся в памяти
+    процесса. Перестраивается лениво, при изменении версии справочника.
+    """
+
+    def __init__(self, index_class) -> None:
+        self.index_class = index_class
+        self._lock = Lock()
+        self._index = None
+        self._version = None
+
+    def get(self):
+        """
+        Возвращает актуальный индекс, при необходимости перестраивая.
+        Версия читается до чтения ингредиентов: если справочник изменится
+        во время перестроения, индекс запомнится со старой версией и
+        будет перестроен при следующем поиске.
+        """
+        version = reference_version('ingredient').version
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    rows = IngredientSerializer(
+                        Ingredient.objects.all(), many=True
+                    ).data
+                    self._index = self.index_class(
+                        [dict(row) for row in rows]
+                    )
+                    self._version = version
+        return self._index
+
+
+ingredient_prefix_index = IngredientIndex(PrefixIndex)
+ingredient_trigram_index = IngredientIndex(TrigramIndex)
+
+
+class WordSimilarity(Func):
+    """Функция word_similarity(запрос, поле) из pg_trgm."""
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+
+class TrigramSimilarity(Func):
+    """Функция similarity(поле, запрос) из pg_trgm."""
+    function = 'SIMILARITY'
+    output_field = FloatField()
+
+
+class WordSimilar(Func):
+    """
+    Оператор "запрос <% поле" из pg_trgm. В отличие от сравнения
+    word_similarity с порогом, использует GIN-индекс по полю.
+    """
+    arg_joiner = ' <%% '
+    template = '(%(expressions)s)'
+    output_field = BooleanField()
+
+
+def search_ingredients(query: str) -> list:
+    """
+    Поиск ингредиентов с учётом опечаток, отсортированный по сходству.
+    На PostgreSQL выполняется через pg_trgm, на остальных СУБД - по
+    индексу триграмм в памяти.
+    """
+    limit = settings.INGREDIENT_SEARCH_LIMIT
+    if connection.vendor != 'postgresql':
+        return ingredient_trigram_index.get().search(
+            query, limit, settings.INGREDIENT_SEARCH_THRESHOLD
+        )
+    ingredients = Ingredient.objects.filter(
+        WordSimilar(Value(query), 'name')
+    ).annotate(
+        rank=WordSimilarity(Value(query), 'name'),
+        similarity=TrigramSimilarity('name', Value(query)),
+    ).order_by('-rank', '-similarity', 'name')[:limit]
+    return IngredientSerializer(ingredients, many=True).data
+
+
+def search_recipes(queryset, query: str):
+    """
+    Отбирает рецепты, в названии или описании которых есть слова запроса,
+    и сортирует их по релевантности, затем по дате публикации.
+
+    На PostgreSQL используется столбец search_vector (конфигурация
+    "russian", поэтому находятся и другие словоформы) и синтаксис
+    websearch_to_tsquery. На SQLite (например, в тестах) запрос ищется
+    подстрокой без учёта регистра, совпадения в названии идут первыми.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).alias(
+            rank=Case(
+                When(name__icontains=query, then=Value(1.0)),
+                default=Value(0.0),
+                output_field=FloatField()
+            )
+        ).order_by('-rank', '-pub_date', '-id')
+    search_query = SearchQuery(
+        query, config='russian', search_type='websearch'
+    )
+    vector = RawSQL(
+        f'{queryset.model._meta.db_table}.search_vector', [],
+        output_field=SearchVectorField()
+    )
+    return queryset.alias(search_vector=vector).filter(
+        search_vector=search_query
+    ).alias(
+        rank=SearchRank(vector, search_query)
+    ).order_by('-rank', '-pub_date', '-id')
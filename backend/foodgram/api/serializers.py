@@ -2,14 +2,20 @@ from re import match
 from typing import Any
 
 from django.conf import settings
+from django.db import transaction
 from django.db.models import F
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 from drf_extra_fields.fields import Base64ImageField
-from recipe.models import Ingredient, Recipe, Tag, User
+from recipe.models import Ingredient, Recipe, ShoppingListJob, Tag, User
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
-from .utils import recipe_amount_ingredients_set
-from .validators import class_obj_validate, hex_color_validate
+from .images import (enqueue_recipe_image, image_url, image_variants,
+                     store_recipe_image)
+from .utils import (cart_version_bump, recipe_amount_ingredients_set,
+                    recipe_amount_ingredients_sync, recipe_tags_sync)
+from .validators import (class_obj_validate, class_objs_validate,
+                         hex_color_validate, image_validate)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -40,6 +46,12 @@ class UserSerializer(serializers.ModelSerializer):
         user = self.context.get('request').user
         if user.is_anonymous or (user == obj):
             return False
+        annotated = getattr(obj, 'is_subscribed', None)
+        if annotated is not None:
+            return annotated
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is not None:
+            return obj.id in subscriptions
         return user.subscription.filter(id=obj.id).exists()
 
 
@@ -51,19 +63,23 @@ class UserFollowsSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField(
         method_name='paginated_recipes'
     )
-    recipes_count = serializers.SerializerMethodField(
-        method_name='get_recipes_count'
-    )
-
-    def get_recipes_count(self, obj: object) -> int:
-        """Показывает суммарное количество рецептов у каждого автора."""
-        return obj.recipes.count()
+    recipes_count = serializers.ReadOnlyField()
 
     def paginated_recipes(self, obj):
-        limit = self.context.get('request').query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        """
+        Показывает первые "recipes_limit" рецептов автора.
+        Если рецепты подгружены заранее (атрибут "recipes_preview"),
+        запрос к базе не выполняется.
+        """
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is None:
+            limit = self.context.get('request').query_params.get(
+                'recipes_limit'
+            )
+            recipes = obj.recipes.all()
+            if limit:
+                class_obj_validate(value=limit)
+                recipes = recipes[:int(limit)]
         serializer = RecipeShortSerializer(recipes, many=True)
         return serializer.data
 
@@ -147,17 +163,126 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('__all__',)
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
-    """Сериализатор для модели Recipe с сокращённым списком полей."""
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта: строка base64 в JSON или файл из multipart/form-data
+    (см. RecipeMultiPartParser).
+    Размер файла проверяется до декодирования base64, размер в пикселях -
+    до декодирования изображения. Тип файла определяется по содержимому.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            if len(data) * 3 // 4 > settings.IMAGE_MAX_BYTES:
+                raise serializers.ValidationError(
+                    f'Размер изображения больше {settings.IMAGE_MAX_BYTES} '
+                    f'байт.'
+                )
+            image = super().to_internal_value(data)
+        else:
+            image = serializers.ImageField.to_internal_value(self, data)
+            extension = image.image.format.lower()
+            extension = 'jpg' if extension == 'jpeg' else extension
+            if extension not in self.ALLOWED_TYPES:
+                raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+            image.name = f'image.{extension}'
+        image_validate(image)
+        return image
+
+
+class RecipeImagesMixin(serializers.Serializer):
+    """
+    Поле "images" с адресами готовых вариантов изображения рецепта
+    (см. api.images). Пока варианты не построены, словарь пуст.
+    """
+    images = serializers.SerializerMethodField(method_name='get_images')
+
+    def get_images(self, obj: object) -> dict:
+        request = self.context.get('request')
+        return {
+            variant: image_url(request, name)
+            for variant, name in image_variants(obj).items()
+        }
+
+    def get_image_variant(self, obj: object, variant: str) -> str:
+        """URL варианта изображения или, пока его нет, оригинала."""
+        name = image_variants(obj).get(variant, obj.image.name)
+        return image_url(self.context.get('request'), name) if name else None
+
+
+class RecipeShortSerializer(RecipeImagesMixin, serializers.ModelSerializer):
+    """
+    Сериализатор для модели Recipe с сокращённым списком полей.
+    Вместо оригинала изображения отдаёт миниатюру, когда она готова.
+    """
+    image = serializers.SerializerMethodField(method_name='get_image')
+
+    def get_image(self, obj: object) -> str:
+        return self.get_image_variant(obj, 'thumbnail')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         read_only_fields = ('__all__',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для модели Recipe."""
+class AuthorFragmentSerializer(UserSerializer):
+    """Автор рецепта без персонального поля "is_subscribed"."""
+    is_subscribed = None
+
+    class Meta(UserSerializer.Meta):
+        fields = (
+            'id',
+            'email',
+            'username',
+            'first_name',
+            'last_name'
+        )
+        read_only_fields = ()
+
+
+class RecipeCoverageSerializer(RecipeShortSerializer):
+    """
+    Сериализатор рецепта для подбора по имеющимся ингредиентам.
+    Ожидает у рецепта атрибуты "total" и "matched" и подгруженные
+    ингредиенты; id имеющихся ингредиентов передаются в контексте
+    ("ingredient_ids").
+    """
+    ingredients_count = serializers.IntegerField(source='total')
+    matched_count = serializers.IntegerField(source='matched')
+    missing_ingredients = serializers.SerializerMethodField(
+        method_name='get_missing_ingredients'
+    )
+
+    def get_missing_ingredients(self, obj: object) -> list:
+        """Ингредиенты рецепта, которых нет у пользователя."""
+        available = self.context.get('ingredient_ids')
+        return [
+            {
+                'id': item.ingredients.id,
+                'name': item.ingredients.name,
+                'measurement_unit': item.ingredients.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredient.all()
+            if item.ingredients_id not in available
+        ]
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = (
+            *RecipeShortSerializer.Meta.fields,
+            'ingredients_count',
+            'matched_count',
+            'missing_ingredients'
+        )
+
+
+class RecipeSerializer(RecipeImagesMixin, serializers.ModelSerializer):
+    """
+    Сериализатор для модели Recipe.
+    Если в контексте передан "image_variant" (для списков рецептов), в поле
+    "image" отдаётся этот вариант изображения.
+    """
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField(
@@ -169,10 +294,24 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField(
         method_name='get_is_in_shopping_cart'
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     def get_ingredients(self, obj: object) -> Any:
-        """Возвращает список ингридиентов для рецепта."""
+        """
+        Возвращает список ингридиентов для рецепта.
+        Если строки IngredientAmount подгружены через prefetch_related,
+        список собирается без обращения к базе.
+        """
+        if 'ingredient' in getattr(obj, '_prefetched_objects_cache', {}):
+            return [
+                {
+                    'id': item.ingredients.id,
+                    'name': item.ingredients.name,
+                    'measurement_unit': item.ingredients.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in obj.ingredient.all()
+            ]
         return obj.ingredients.values(
             'id',
             'name',
@@ -186,8 +325,12 @@ class RecipeSerializer(serializers.ModelSerializer):
         текущего пользователя.
         """
         user = self.context.get('request').user
-        return (user.is_authenticated
-                and user.favorites.filter(id=obj.id).exists())
+        if user.is_anonymous:
+            return False
+        annotated = getattr(obj, 'is_favorited', None)
+        if annotated is not None:
+            return annotated
+        return user.favorites.filter(id=obj.id).exists()
 
     def get_is_in_shopping_cart(self, obj: object) -> bool:
         """
@@ -195,8 +338,12 @@ class RecipeSerializer(serializers.ModelSerializer):
         текущего пользователя.
         """
         user = self.context.get('request').user
-        return (user.is_authenticated
-                and user.in_cart.filter(id=obj.id).exists())
+        if user.is_anonymous:
+            return False
+        annotated = getattr(obj, 'is_in_shopping_cart', None)
+        if annotated is not None:
+            return annotated
+        return user.in_cart.filter(id=obj.id).exists()
 
     def validate(self, data):
         """Проверка вводных данных при создании/редактировании рецепта."""
@@ -213,63 +360,96 @@ class RecipeSerializer(serializers.ModelSerializer):
                     f'data: {data}'
                 )
 
+        valid_tags = class_objs_validate(tags, Tag)
         for tag in tags:
-            class_obj_validate(
-                value=tag,
-                klass=Tag
-            )
+            if int(tag) not in valid_tags:
+                raise serializers.ValidationError(
+                    f'Тега с ID={tag} не существует.'
+                )
 
+        found_ingredients = class_objs_validate(
+            [item['id'] for item in ingredients],
+            Ingredient
+        )
         valid_ingredients = []
-        valid_amounts = []
         for item in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
+            ingredient = found_ingredients.get(int(item['id']))
+            if ingredient is None:
+                raise Http404('No Ingredient matches the given query.')
             if ingredient in valid_ingredients:
                 raise serializers.ValidationError(
                     'Ингредиенты не должны повторяться'
                 )
             valid_ingredients.append(ingredient)
             class_obj_validate(value=item['amount'])
-            valid_amounts.append(item['amount'])
         valid_ingredients = [
-            dict(ingredient=i, amount=a) for i, a in zip(
-                valid_ingredients, valid_amounts
+            dict(ingredient=i, amount=item['amount']) for i, item in zip(
+                valid_ingredients, ingredients
             )
         ]
 
         data['name'] = name.lower()
-        data['tags'] = tags
+        data['tags'] = [valid_tags[int(tag)] for tag in tags]
         data['ingredients'] = valid_ingredients
         data['author'] = self.context.get('request').user
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создаёт новый объект модели Recipe."""
-        image = validated_data.pop('image')
+        image = store_recipe_image(validated_data.pop('image'))
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(image=image, **validated_data)
         recipe.tags.set(tags)
         recipe_amount_ingredients_set(recipe, ingredients)
+        enqueue_recipe_image(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
-        """Обновляет объект Recipe."""
+        """
+        Обновляет объект Recipe.
+        Повторная загрузка того же изображения изменением не считается.
+        Теги и ингредиенты сравниваются с текущими и меняются только
+        отличающиеся строки. Признак того, что рецепт действительно
+        изменился, сохраняется в атрибут "changed" сериализатора.
+        """
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        if validated_data.get('image') is not None:
+            validated_data['image'] = store_recipe_image(
+                validated_data['image']
+            )
+        old_image = recipe.image.name
 
-        super().update(recipe, validated_data)
-
-        if tags:
-            recipe.tags.clear()
-            recipe.tags.set(tags)
-
-        if ingredients:
-            recipe.ingredients.clear()
-            recipe_amount_ingredients_set(recipe, ingredients)
+        fields_changed = any(
+            getattr(recipe, attr) != value
+            for attr, value in validated_data.items()
+        )
+        if fields_changed:
+            super().update(recipe, validated_data)
+            if recipe.image.name != old_image:
+                enqueue_recipe_image(recipe)
+
+        tags_changed = bool(tags) and recipe_tags_sync(recipe, tags)
+        ingredients_changed = (
+            bool(ingredients)
+            and recipe_amount_ingredients_sync(recipe, ingredients)
+        )
+        if ingredients_changed:
+            cart_version_bump(recipe.shopping_cart.all())
 
-        recipe.save()
+        self.changed = fields_changed or tags_changed or ingredients_changed
         return recipe
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        variant = self.context.get('image_variant')
+        if variant:
+            data['image'] = self.get_image_variant(instance, variant)
+        return data
+
     class Meta:
         model = Recipe
         fields = (
@@ -279,6 +459,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
             'is_favorited',
@@ -288,3 +469,70 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_favorite',
             'is_shopping_cart'
         )
+
+
+class RecipeFragmentSerializer(RecipeSerializer):
+    """
+    Общая для всех пользователей часть RecipeSerializer - без полей
+    "is_favorited", "is_in_shopping_cart" и "author.is_subscribed".
+    Результат кэшируется по версии рецепта (см. FragmentCacheMixin).
+    """
+    author = AuthorFragmentSerializer(read_only=True)
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeSerializer.Meta):
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'name',
+            'image',
+            'images',
+            'text',
+            'cooking_time'
+        )
+
+
+class ShoppingListJobSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор задачи на формирование списка покупок.
+    Поле "file" содержит ссылку на готовый файл, пока задача не завершена
+    оно пустое. "outdated" - список покупок изменился после формирования
+    файла: ссылки на файл нет, нужна новая задача.
+    """
+    file = serializers.SerializerMethodField(method_name='get_file')
+    outdated = serializers.SerializerMethodField(method_name='get_outdated')
+
+    def get_outdated(self, obj: object) -> bool:
+        """Проверяет, что файл сформирован для текущего списка покупок."""
+        return (
+            obj.status == ShoppingListJob.Status.DONE
+            and obj.cart_version != obj.user.cart_version
+        )
+
+    def get_file(self, obj: object) -> Any:
+        """Возвращает ссылку на готовый файл."""
+        if (obj.status != ShoppingListJob.Status.DONE
+                or self.get_outdated(obj)):
+            return None
+        return reverse(
+            'api:recipes-shopping-list-job-file',
+            kwargs={'job_id': obj.id},
+            request=self.context.get('request')
+        )
+
+    class Meta:
+        model = ShoppingListJob
+        fields = (
+            'id',
+            'file_format',
+            'status',
+            'error',
+            'created',
+            'finished',
+            'file',
+            'outdated'
+        )
+        read_only_fields = fields
@@ -0,0 +1,132 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from recipe.models import Ingredient, Recipe, Tag, User
+
+from .utils import (cart_version_bump, counter_update, feed_fanout,
+                    feed_fanout_resume, recipes_version_bump,
+                    reference_version_bump)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    """
+    Меняет версию справочника ингредиентов при их изменении - по ней
+    перестраиваются индексы поиска (см. search).
+    """
+    reference_version_bump('ingredient')
+    reference_version_bump('recipe')
+
+
+@receiver((post_save, pre_delete), sender=Ingredient)
+def ingredient_recipes_changed(instance, **kwargs):
+    """
+    Меняет версию рецептов с изменённым ингредиентом и списков покупок с
+    этими рецептами: в готовых файлах списков есть название и единицы
+    измерения ингредиента.
+    """
+    recipes_version_bump(Recipe.objects.filter(ingredients=instance))
+    cart_version_bump(
+        User.objects.filter(in_cart__ingredients=instance).distinct()
+    )
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    """Меняет версию справочника тегов при их изменении."""
+    reference_version_bump('tag')
+    reference_version_bump('recipe')
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+def tag_recipes_changed(instance, **kwargs):
+    """Меняет версию рецептов с изменённым тегом."""
+    recipes_version_bump(Recipe.objects.filter(tags=instance))
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_version(instance, **kwargs):
+    """Увеличивает версию рецепта при каждом сохранении."""
+    if not instance._state.adding:
+        instance.version = F('version') + 1
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(**kwargs):
+    """
+    Меняет поколение кэша ответов с рецептами.
+    Теги и ингредиенты в API меняются без сохранения рецепта - для них
+    поколение меняется в RecipeViewSet.perform_update; админка сохраняет
+    рецепт вместе со связанными объектами.
+    """
+    reference_version_bump('recipe')
+
+
+@receiver((post_save, pre_delete), sender=Recipe)
+def recipe_cart_changed(instance, **kwargs):
+    """
+    Сбрасывает кэш списков покупок с изменённым или удаляемым рецептом -
+    в том числе при изменениях через админку.
+    """
+    cart_version_bump(User.objects.filter(in_cart=instance))
+
+
+AUTHOR_FIELDS = frozenset(
+    ('username', 'email', 'first_name', 'last_name')
+)
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, update_fields, **kwargs):
+    """
+    Меняет поколение кэша ответов с рецептами при изменении данных автора.
+    Служебные сохранения (например, last_login при входе) не учитываются.
+    """
+    if update_fields is not None and not AUTHOR_FIELDS & update_fields:
+        return
+    if instance.recipes_count:
+        recipes_version_bump(instance.recipes.all())
+        reference_version_bump('recipe')
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    """
+    Увеличивает счётчик рецептов автора и записывает новый рецепт в ленты
+    его подписчиков.
+    """
+    if created:
+        counter_update(
+            User.objects.filter(id=instance.author_id), 'recipes_count', 1
+        )
+        feed_fanout(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    """
+    Уменьшает счётчик рецептов автора. Изображение остаётся в хранилище до
+    запуска команды dedup_images (см. images).
+    """
+    counter_update(
+        User.objects.filter(id=instance.author_id), 'recipes_count', -1
+    )
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(instance, **kwargs):
+    """
+    Уменьшает счётчики подписчиков, избранного и списков покупок,
+    в которые входил удаляемый пользователь; рецепты авторов, вернувшихся
+    к FEED_FANOUT_LIMIT подписчиков, снова записываются в ленты.
+    """
+    authors = User.objects.filter(followers=instance)
+    counter_update(authors, 'followers_count', -1)
+    feed_fanout_resume(authors, exclude_user=instance.id)
+    counter_update(
+        Recipe.objects.filter(favorite=instance), 'favorites_count', -1
+    )
+    counter_update(
+        Recipe.objects.filter(shopping_cart=instance), 'in_cart_count', -1
+    )
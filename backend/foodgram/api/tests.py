@@ -0,0 +1,1106 @@
+import json
+import os
+import shutil
+import tempfile
+from base64 import b64encode
+from io import BytesIO, StringIO
+from itertools import combinations
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import urlencode
+from PIL import Image
+from recipe.models import Ingredient, IngredientAmount, Recipe, Tag
+from rest_framework.test import APIClient
+
+from .filters import RecipeFilter
+from .images import store_recipe_image
+from .jobs import run_shopping_list_job
+from .pdf import ShoppingListPDF
+from .utils import reference_version_bump
+
+User = get_user_model()
+
+
+class RecipeFilterTests(TestCase):
+    """
+    Сочетания отборов рецептов выполняются одним SELECT и не дублируют
+    рецепты с несколькими подходящими тегами.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, other = (
+            User.objects.create_user(
+                username=username,
+                email=f'{username}@example.com',
+                password='password'
+            )
+            for username in ('user', 'author', 'other')
+        )
+        tags = [
+            Tag.objects.create(name=slug, slug=slug, color=color)
+            for slug, color in (
+                ('breakfast', '#E26C2D'),
+                ('lunch', '#49B64E'),
+                ('dinner', '#8775D2')
+            )
+        ]
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                author=cls.author if number % 2 else other,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image=f'recipe_images/{number}.jpg'
+            )
+            # Рецепты с двумя тегами попадают под отбор по обоим.
+            recipe.tags.add(*tags[number % 3:number % 3 + 2])
+            if number % 3:
+                recipe.favorite.add(cls.user)
+            if number < 5:
+                recipe.shopping_cart.add(cls.user)
+        cls.params = {
+            'tags': ['breakfast', 'lunch'],
+            'author': cls.author.id,
+            'is_favorited': True,
+            'is_in_shopping_cart': True,
+        }
+        cls.checks = {
+            'tags': lambda recipe: {'breakfast', 'lunch'} & {
+                tag.slug for tag in recipe.tags.all()
+            },
+            'author': lambda recipe: recipe.author_id == cls.author.id,
+            'is_favorited': lambda recipe: recipe.favorite.filter(
+                id=cls.user.id
+            ).exists(),
+            'is_in_shopping_cart': lambda recipe: recipe.shopping_cart.filter(
+                id=cls.user.id
+            ).exists(),
+        }
+
+    def filter_recipes(self, params: dict):
+        request = RequestFactory().get('/api/recipes/', params)
+        request.user = self.user
+        return RecipeFilter(
+            request.GET, queryset=Recipe.objects.all(), request=request
+        ).qs
+
+    def test_filter_combinations(self):
+        recipes = list(Recipe.objects.prefetch_related('tags'))
+        for size in range(1, len(self.params) + 1):
+            for names in combinations(self.params, size):
+                with self.subTest(filters=names):
+                    queryset = self.filter_recipes(
+                        {name: self.params[name] for name in names}
+                    )
+                    with CaptureQueriesContext(connection) as context:
+                        ids = list(queryset.values_list('id', flat=True))
+                    self.assertEqual(len(context.captured_queries), 1)
+                    self.assertTrue(
+                        context.captured_queries[0]['sql'].startswith('SELECT')
+                    )
+                    self.assertEqual(len(ids), len(set(ids)))
+                    self.assertEqual(set(ids), {
+                        recipe.id for recipe in recipes
+                        if all(self.checks[name](recipe) for name in names)
+                    })
+
+
+class RecipeListQueriesTests(TestCase):
+    """
+    Число запросов страницы рецептов не зависит от её размера: флаги
+    "is_favorited" и "is_in_shopping_cart" загружаются для всей страницы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        for number in range(6):
+            recipe = Recipe.objects.create(
+                author=cls.user,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image=f'recipe_images/{number}.jpg'
+            )
+            if number % 2:
+                recipe.favorite.add(cls.user)
+            if number % 3:
+                recipe.shopping_cart.add(cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get_page(self, limit: int) -> tuple:
+        caches[settings.RECIPE_CACHE].clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], context.captured_queries
+
+    def test_flags(self):
+        self.client.force_authenticate(self.user)
+        results, queries = self.get_page(6)
+        self.assertEqual(len(self.get_page(2)[1]), len(queries))
+        for item in results:
+            recipe = Recipe.objects.get(id=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                recipe.favorite.filter(id=self.user.id).exists()
+            )
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                recipe.shopping_cart.filter(id=self.user.id).exists()
+            )
+
+    def test_anonymous_flags_without_queries(self):
+        results, queries = self.get_page(6)
+        tables = (
+            Recipe.favorite.through._meta.db_table,
+            Recipe.shopping_cart.through._meta.db_table,
+        )
+        self.assertFalse([
+            query for query in queries
+            if any(table in query['sql'] for table in tables)
+        ])
+        self.assertFalse(any(
+            item['is_favorited'] or item['is_in_shopping_cart']
+            for item in results
+        ))
+
+
+class AnonymousRecipeCacheTests(TestCase):
+    """
+    Ответы списка и отдельного рецепта для анонимных пользователей берутся
+    из кэша одним запросом и сбрасываются изменением рецепта или тега.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.recipe = Recipe.objects.create(
+            author=author,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        cls.recipe.tags.add(cls.tag)
+
+    def setUp(self):
+        caches[settings.RECIPE_CACHE].clear()
+
+    def get(self, url: str):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit_and_invalidation(self):
+        detail = f'/api/recipes/{self.recipe.id}/'
+        for url in ('/api/recipes/?limit=6', detail):
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+                with self.assertNumQueries(1):
+                    response = self.get(url)
+                self.assertEqual(response['X-Cache'], 'HIT')
+
+                recipe = Recipe.objects.get(id=self.recipe.id)
+                recipe.cooking_time += 1
+                recipe.save()
+                response = self.get(url)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertIn(
+                    f'"cooking_time":{recipe.cooking_time}'.encode(),
+                    response.content
+                )
+
+                self.tag.save()
+                self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+                self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+
+class RecipeIngredientsPrefetchTests(TestCase):
+    """
+    Теги и ингредиенты страницы рецептов загружаются по одному запросу на
+    страницу, формат вывода ингредиентов прежний.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='password'
+        )
+        tags = [
+            Tag.objects.create(name=slug, slug=slug, color='#E26C2D')
+            for slug in ('breakfast', 'lunch')
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Тестовый ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        for number in range(6):
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image=f'recipe_images/{number}.jpg'
+            )
+            recipe.tags.add(*tags[:number % 2 + 1])
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe, ingredients=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[number % 3:]
+            )
+
+    def get_page(self, limit: int) -> tuple:
+        caches[settings.RECIPE_CACHE].clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(context.captured_queries)
+
+    def test_page(self):
+        results, queries = self.get_page(6)
+        self.assertEqual(self.get_page(2)[1], queries)
+        for item in results:
+            amounts = IngredientAmount.objects.filter(
+                recipe_id=item['id']
+            ).select_related('ingredients').order_by('ingredients__name')
+            self.assertEqual(item['ingredients'], [
+                {
+                    'id': amount.ingredients.id,
+                    'name': amount.ingredients.name,
+                    'measurement_unit': amount.ingredients.measurement_unit,
+                    'amount': amount.amount,
+                }
+                for amount in amounts
+            ])
+            self.assertEqual(
+                [tag['slug'] for tag in item['tags']],
+                list(Tag.objects.filter(
+                    recipes__id=item['id']
+                ).values_list('slug', flat=True))
+            )
+
+
+class RecipeWriteQueriesTests(TestCase):
+    """
+    Число запросов при изменении и удалении рецепта не зависит от числа
+    его ингредиентов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Тестовый ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(12)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def create_recipe(self, ingredients: int) -> Recipe:
+        recipe = Recipe.objects.create(
+            author=self.author,
+            name=f'Рецепт {ingredients}',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        recipe.tags.add(self.tag)
+        recipe.shopping_cart.add(self.author)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredients=ingredient, amount=1)
+            for ingredient in self.ingredients[:ingredients]
+        )
+        return recipe
+
+    def count_queries(self, method: str, ingredients: int, **kwargs) -> int:
+        recipe = self.create_recipe(ingredients)
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(
+                f'/api/recipes/{recipe.id}/', format='json', **kwargs
+            )
+        self.assertLess(response.status_code, 300, response.content)
+        return len(context.captured_queries)
+
+    def test_update_dropping_ingredients(self):
+        data = [
+            {
+                'name': name,
+                'text': 'Описание',
+                'cooking_time': 10,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 5}],
+            }
+            for name in ('Новое название 1', 'Новое название 2')
+        ]
+        self.assertEqual(
+            self.count_queries('patch', 12, data=data[0]),
+            self.count_queries('patch', 2, data=data[1])
+        )
+
+    def test_delete(self):
+        self.assertEqual(
+            self.count_queries('delete', 12),
+            self.count_queries('delete', 2)
+        )
+
+
+class RecipeUpdateDiffTests(TestCase):
+    """
+    Изменение рецепта меняет только отличающиеся строки ингредиентов;
+    повторная отправка тех же данных ничего не пишет в базу.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Тестовый ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name='рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        cls.recipe.tags.add(cls.tag)
+        cls.recipe.shopping_cart.add(cls.author)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe=cls.recipe, ingredients=ingredient, amount=100
+            )
+            for ingredient in cls.ingredients
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def write_queries(self, amounts: list) -> list:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {
+                    'name': self.recipe.name,
+                    'text': self.recipe.text,
+                    'cooking_time': self.recipe.cooking_time,
+                    'tags': [self.tag.id],
+                    'ingredients': [
+                        {'id': ingredient.id, 'amount': amount}
+                        for ingredient, amount in zip(self.ingredients,
+                                                      amounts)
+                    ],
+                },
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+
+    def test_same_data(self):
+        self.assertEqual(self.write_queries([100, 100, 100]), [])
+        self.assertEqual(Recipe.objects.get().version, self.recipe.version)
+        self.assertEqual(User.objects.get().cart_version, 0)
+
+    def test_one_amount_changed(self):
+        queries = [
+            sql for sql in self.write_queries([100, 200, 100])
+            if IngredientAmount._meta.db_table in sql
+        ]
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+        self.assertEqual(
+            list(IngredientAmount.objects.order_by(
+                'ingredients__name'
+            ).values_list('amount', flat=True)),
+            [100, 200, 100]
+        )
+        self.assertEqual(User.objects.get().cart_version, 1)
+
+
+class IngredientChangedTests(TestCase):
+    """
+    Изменение ингредиента меняет версию списков покупок с рецептами, в
+    которых он есть.
+    """
+
+    def test_cart_version_bumped(self):
+        user, other = (
+            User.objects.create_user(
+                username=username,
+                email=f'{username}@example.com',
+                password='password'
+            )
+            for username in ('user', 'other')
+        )
+        ingredient = Ingredient.objects.create(name='Тестовая мука',
+                                               measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=user,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        IngredientAmount.objects.create(
+            recipe=recipe, ingredients=ingredient, amount=100
+        )
+        recipe.shopping_cart.add(user)
+        ingredient.measurement_unit = 'кг'
+        ingredient.save()
+        user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(user.cart_version, 1)
+        self.assertEqual(other.cart_version, 0)
+
+
+class SubscriptionsTests(TestCase):
+    """
+    Число запросов списка подписок не зависит от числа авторов и их
+    рецептов: превью рецептов вместе с вариантами изображений
+    подгружаются одним запросом.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_authors(self, count: int):
+        start = self.user.subscription.count()
+        for number in range(start, start + count):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password'
+            )
+            for recipe_number in range(3):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {recipe_number}',
+                    text='Описание',
+                    cooking_time=10,
+                    image=f'recipe_images/{number}_{recipe_number}.jpg',
+                    image_variants={
+                        'source': f'recipe_images/{number}_{recipe_number}'
+                                  f'.jpg',
+                        'files': {},
+                    }
+                )
+            self.user.subscription.add(author)
+
+    def count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_queries_independent_of_authors(self):
+        for url in ('/api/users/subscriptions/',
+                    '/api/users/subscriptions/?recipes_limit=2'):
+            with self.subTest(url=url):
+                self.add_authors(2)
+                queries = self.count_queries(url)
+                self.add_authors(3)
+                self.assertEqual(self.count_queries(url), queries)
+
+
+class SubscribedFlagTests(TestCase):
+    """
+    Подписки текущего пользователя для "is_subscribed" загружаются одним
+    запросом и только для пользователей текущей страницы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        for number in range(4):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password'
+            )
+            Recipe.objects.create(
+                author=author,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipe_images/recipe.jpg'
+            )
+            cls.user.subscription.add(author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscription_queries(self, url: str) -> tuple:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        table = User.subscription.through._meta.db_table
+        return response.json(), [
+            query['sql'] for query in context.captured_queries
+            if table in query['sql']
+        ]
+
+    def test_users_page(self):
+        data, queries = self.subscription_queries('/api/users/?limit=2')
+        self.assertEqual(len(queries), 1)
+        self.assertIn(' IN ', queries[0])
+        for item in data['results']:
+            self.assertEqual(
+                item['is_subscribed'], item['username'].startswith('author')
+            )
+
+    def test_recipes_page(self):
+        data, queries = self.subscription_queries('/api/recipes/?limit=2')
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(all(
+            item['author']['is_subscribed'] for item in data['results']
+        ))
+
+
+def image_upload(color: str) -> SimpleUploadedFile:
+    """Загружаемый файл с изображением PNG 4x4 цвета color."""
+    buffer = BytesIO()
+    Image.new('RGB', (4, 4), color).save(buffer, 'PNG')
+    return SimpleUploadedFile('image.png', buffer.getvalue(), 'image/png')
+
+
+class MediaTestCase(TestCase):
+    """Тесты с хранилищем файлов во временном каталоге."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class RecipeImageStorageTests(MediaTestCase):
+    """
+    Повторно загруженное изображение не удаляется командой dedup_images,
+    даже если файл старше --min-age; файлы без ссылок удаляются.
+    """
+
+    def make_old(self, name: str):
+        old = os.path.getmtime(default_storage.path(name)) - 24 * 60 * 60
+        os.utime(default_storage.path(name), (old, old))
+
+    def test_reused_image_survives_garbage_collection(self):
+        reused = store_recipe_image(image_upload('red'))
+        orphan = store_recipe_image(image_upload('blue'))
+        self.make_old(reused)
+        self.make_old(orphan)
+        # Рецепт с тем же изображением ещё не сохранён.
+        self.assertEqual(store_recipe_image(image_upload('red')), reused)
+        call_command('dedup_images', stdout=StringIO())
+        self.assertTrue(default_storage.exists(reused))
+        self.assertFalse(default_storage.exists(orphan))
+
+
+class RecipeCreateTests(MediaTestCase):
+    """
+    Число запросов при создании рецепта не зависит от числа ингредиентов,
+    ошибка при сохранении не оставляет рецепт без ингредиентов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Тестовый ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_recipe(self, ingredients: int):
+        image = b64encode(image_upload('red').read()).decode()
+        return self.client.post('/api/recipes/', {
+            'name': f'Рецепт {ingredients}',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 100}
+                for ingredient in self.ingredients[:ingredients]
+            ],
+            'image': f'data:image/png;base64,{image}',
+        }, format='json')
+
+    def count_queries(self, ingredients: int) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_recipe(ingredients)
+        self.assertEqual(response.status_code, 201, response.content)
+        return len(context.captured_queries)
+
+    def test_queries_independent_of_ingredients(self):
+        self.assertEqual(self.count_queries(10), self.count_queries(1))
+
+    def test_failed_save_rolled_back(self):
+        with mock.patch('api.serializers.recipe_amount_ingredients_set',
+                        side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.post_recipe(2)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class RecipeMultipartTests(MediaTestCase):
+    """Создание рецепта в multipart/form-data с изображением-файлом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.ingredient = Ingredient.objects.create(name='Тестовая мука',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': json.dumps(
+                [{'id': self.ingredient.id, 'amount': 100}]
+            ),
+            'image': image,
+        }, format='multipart')
+
+    def test_image_file(self):
+        response = self.post_recipe(image_upload('red'))
+        self.assertEqual(response.status_code, 201, response.content)
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.tags.get(), self.tag)
+        self.assertEqual(recipe.ingredients.get(), self.ingredient)
+        self.assertTrue(default_storage.exists(recipe.image.name))
+
+    def test_not_image_rejected(self):
+        response = self.post_recipe(
+            SimpleUploadedFile('image.txt', b'text', 'text/plain')
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_form_urlencoded(self):
+        recipe = Recipe.objects.create(
+            author=self.user,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            urlencode({
+                'name': 'Новый рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'tags': [self.tag.id],
+                'ingredients': json.dumps(
+                    [{'id': self.ingredient.id, 'amount': 100}]
+                ),
+            }, doseq=True),
+            content_type='application/x-www-form-urlencoded'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'новый рецепт')
+        self.assertEqual(recipe.tags.get(), self.tag)
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedFanoutLimitTests(TestCase):
+    """
+    Рецепты автора остаются в ленте подписчика, когда число подписчиков
+    автора переходит через FEED_FANOUT_LIMIT в обе стороны.
+    """
+
+    def setUp(self):
+        self.author, self.reader, self.other = (
+            User.objects.create_user(
+                username=username,
+                email=f'{username}@example.com',
+                password='password'
+            )
+            for username in ('author', 'reader', 'other')
+        )
+        self.subscribe(self.reader, 'post')
+        self.first = self.publish('Первый')
+        # Подписчиков становится больше FEED_FANOUT_LIMIT.
+        self.subscribe(self.other, 'post')
+        self.second = self.publish('Второй')
+
+    def subscribe(self, user, method: str):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = getattr(client, method)(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertIn(response.status_code, (201, 204))
+
+    def publish(self, name: str) -> Recipe:
+        return Recipe.objects.create(
+            author=self.author,
+            name=name,
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+
+    def feed(self) -> list:
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        response = client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_above_limit(self):
+        self.assertEqual(self.feed(), [self.second.id, self.first.id])
+
+    def test_back_under_limit_after_unsubscribe(self):
+        self.subscribe(self.other, 'delete')
+        self.assertEqual(self.feed(), [self.second.id, self.first.id])
+        self.assertTrue(self.reader.feed.filter(recipe=self.second).exists())
+
+    def test_back_under_limit_after_follower_deleted(self):
+        self.other.delete()
+        self.assertEqual(self.feed(), [self.second.id, self.first.id])
+        self.assertTrue(self.reader.feed.filter(recipe=self.second).exists())
+
+
+class FeedQueriesTests(TestCase):
+    """
+    Число запросов страницы ленты не зависит от числа авторов, на которых
+    подписан пользователь, и числа их рецептов - и для рецептов из таблицы
+    ленты, и для подмешиваемых при чтении.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='password'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def add_authors(self, count: int):
+        start = self.reader.subscription.count()
+        for number in range(start, start + count):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password'
+            )
+            response = self.client.post(f'/api/users/{author.id}/subscribe/')
+            self.assertEqual(response.status_code, 201)
+            for recipe_number in range(3):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {recipe_number}',
+                    text='Описание',
+                    cooking_time=10,
+                    image='recipe_images/recipe.jpg'
+                )
+
+    def count_queries(self) -> int:
+        caches[settings.RECIPE_CACHE].clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/feed/', {'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            list(Recipe.objects.filter(
+                author__followers=self.reader
+            ).order_by('-pub_date', '-id').values_list('id', flat=True)[:5])
+        )
+        return len(context.captured_queries)
+
+    def test_queries_independent_of_authors(self):
+        for limit in (10000, 0):
+            with self.subTest(fanout_limit=limit):
+                with override_settings(FEED_FANOUT_LIMIT=limit):
+                    self.add_authors(2)
+                    queries = self.count_queries()
+                    self.add_authors(3)
+                    self.assertEqual(self.count_queries(), queries)
+
+
+class ShoppingListJobTests(TestCase):
+    """
+    Фоновое формирование списка покупок: формат из параметра "format",
+    файл не отдаётся после изменения списка покупок.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipe_images/recipe.jpg'
+            )
+            for number in range(2)
+        ]
+        IngredientAmount.objects.create(
+            recipe=cls.recipes[0],
+            ingredients=Ingredient.objects.create(
+                name='Тестовая мука', measurement_unit='г'
+            ),
+            amount=100
+        )
+        cls.recipes[0].shopping_cart.add(cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_job(self, query: str = '') -> dict:
+        """Создаёт задачу и выполняет её в текущем потоке."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                f'/api/recipes/download_shopping_cart/jobs/{query}'
+            )
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(len(callbacks), 1)
+        # Потоки и закрытие соединений не нужны: тест идёт в транзакции.
+        with mock.patch('api.jobs.close_old_connections'):
+            run_shopping_list_job(response.json()['id'])
+        return self.client.get(
+            f'/api/recipes/download_shopping_cart/jobs/'
+            f'{response.json()["id"]}/'
+        ).json()
+
+    def test_format(self):
+        for query, content_type, start in (
+            ('', 'application/pdf', b'%PDF'),
+            ('?format=pdf', 'application/pdf', b'%PDF'),
+            ('?format=csv', 'text/csv', 'Ингредиент'.encode()),
+            ('?format=txt', 'text/plain', 'Тестовая мука'.encode()),
+            ('?format=json', 'application/json', b'['),
+        ):
+            with self.subTest(query=query):
+                job = self.run_job(query)
+                self.assertEqual(job['status'], 'done', job['error'])
+                self.assertFalse(job['outdated'])
+                response = self.client.get(job['file'])
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith(
+                    content_type
+                ))
+                self.assertTrue(response.content.startswith(start))
+
+    def test_unknown_format(self):
+        response = self.client.post(
+            '/api/recipes/download_shopping_cart/jobs/?format=xls'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_outdated_after_cart_change(self):
+        job = self.run_job('?format=csv')
+        file_url = job['file']
+        response = self.client.post(
+            f'/api/recipes/{self.recipes[1].id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+        # Как при аутентификации по токену, пользователь читается заново.
+        self.client.force_authenticate(User.objects.get(id=self.user.id))
+        job = self.client.get(
+            f'/api/recipes/download_shopping_cart/jobs/{job["id"]}/'
+        ).json()
+        self.assertTrue(job['outdated'])
+        self.assertIsNone(job['file'])
+        self.assertEqual(self.client.get(file_url).status_code, 409)
+
+
+class ShoppingListPDFTests(SimpleTestCase):
+    """Урезанный шрифт и переносы строк в pdf-файле списка покупок."""
+
+    def test_typographic_characters(self):
+        document = ShoppingListPDF()
+        document.render('Пользователь', [{
+            'ingredient': 'конфеты M&M’s «в» “упаковке” – 1… — 2',
+            'sum_amount': 1,
+            'measure': 'г',
+        }])
+        self.assertEqual(document.pdf.fonts['arial'].missing_glyphs, [])
+
+    def test_long_word_wrapped(self):
+        document = ShoppingListPDF()
+        text = 'Очень' + 'длинное' * 10 + ' название'
+        lines = document._wrap(text)
+        self.assertGreater(len(lines), 2)
+        self.assertEqual(''.join(lines).replace(' ', ''),
+                         text.replace(' ', ''))
+        for line in lines:
+            self.assertLessEqual(
+                document.pdf.get_string_width(line), document.text_width
+            )
+
+
+class RecipeSearchPaginationTests(TestCase):
+    """
+    Поиск с параметром "cursor" сохраняет сортировку по релевантности:
+    пагинация по ключу пересортировала бы результаты по дате.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        # Старый рецепт со словом в названии релевантнее нового, где
+        # слово только в описании.
+        cls.relevant, cls.recent = (
+            Recipe.objects.create(
+                author=cls.user,
+                name=name,
+                text=text,
+                cooking_time=10,
+                image='recipe_images/recipe.jpg'
+            )
+            for name, text in (
+                ('Блины', 'Описание'),
+                ('Завтрак', 'Тонкие Блины с вареньем'),
+            )
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe_ids(self, params: dict) -> list:
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_cursor_keeps_relevance(self):
+        self.assertEqual(self.recipe_ids({'cursor': ''}),
+                         [self.recent.id, self.relevant.id])
+        # На SQLite поиск идёт через icontains: регистр кириллицы важен.
+        for params in (
+            {'search': 'Блины'},
+            {'search': 'Блины', 'cursor': ''},
+            {'search': 'Блины', 'cursor': '', 'limit': 1},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.recipe_ids(params)[0], self.relevant.id)
+
+
+class ReferenceConditionalGetTests(TestCase):
+    """Условный запрос справочника по несуществующему id получает 404."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+
+    def test_detail(self):
+        url = f'/api/tags/{self.tag.id}/'
+        missing = f'/api/tags/{self.tag.id + 1}/'
+        etag = self.client.get(url)['ETag']
+        for url, status in ((url, 304), (missing, 404)):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status)
+
+
+class IngredientIndexTests(TestCase):
+    """
+    Индекс поиска ингредиентов в памяти перестраивается по версии
+    справочника, поэтому видит изменения из других процессов.
+    """
+
+    def search(self, name: str) -> list:
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_rebuilt_on_version_change(self):
+        ingredient = Ingredient.objects.create(name='Тестовая мука',
+                                               measurement_unit='г')
+        reference_version_bump('ingredient')
+        self.assertEqual(self.search('Тестов'), ['Тестовая мука'])
+        # Изменение в обход сигналов, как в другом процессе: индекс
+        # перестраивается только после изменения версии.
+        Ingredient.objects.filter(id=ingredient.id).update(
+            name='Тестовый сахар'
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('Тестов'), ['Тестовая мука'])
+        reference_version_bump('ingredient')
+        self.assertEqual(self.search('Тестов'), ['Тестовый сахар'])
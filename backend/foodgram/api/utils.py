@@ -1,88 +1,450 @@
-from datetime import datetime as dt
+import csv
+import json
+from collections import defaultdict
 
-from django.http.response import HttpResponse
-from fpdf import FPDF
-from recipe.models import IngredientAmount
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import (Count, ExpressionWrapper, F, FloatField, Q, Sum,
+                              Window)
+from django.db.models.functions import Cast, Greatest, RowNumber
+from django.http.response import (HttpResponse, HttpResponseNotModified,
+                                  StreamingHttpResponse)
+from django.utils import timezone
+from django.utils.http import parse_etags
+from recipe.models import (FeedEntry, IngredientAmount, Recipe,
+                           ReferenceVersion, User)
+
+from .pdf import render_shopping_list
+
+SHOPPING_LIST_CACHE = 'shopping_lists'
+SHOPPING_LIST_HEADER = ('Ингредиент', 'Количество', 'Единицы измерения')
 
 
 def recipe_amount_ingredients_set(recipe, ingredients):
     """
-    Создаёт объект IngredientAmount связывающий объекты Recipe и
+    Создаёт объекты IngredientAmount связывающие объекты Recipe и
     Ingredient с указанием количества ("amount") конкретного ингридиента.
+    Все строки вставляются одним запросом.
     """
-    for ingredient in ingredients:
-        IngredientAmount.objects.get_or_create(
+    IngredientAmount.objects.bulk_create(
+        IngredientAmount(
             recipe=recipe,
             ingredients=ingredient['ingredient'],
             amount=ingredient['amount'],
         )
+        for ingredient in ingredients
+    )
+
+
+def recipe_amount_ingredients_sync(recipe, ingredients) -> bool:
+    """
+    Приводит ингредиенты рецепта к переданному списку, меняя только
+    отличающиеся строки: новые добавляются, у существующих обновляется
+    количество, лишние удаляются. Возвращает True, если что-то изменилось.
+    """
+    current = {
+        amount.ingredients_id: amount
+        for amount in IngredientAmount.objects.filter(recipe=recipe)
+    }
+    new, changed = [], []
+    for ingredient in ingredients:
+        amount = current.pop(ingredient['ingredient'].id, None)
+        if amount is None:
+            new.append(ingredient)
+        elif amount.amount != int(ingredient['amount']):
+            amount.amount = ingredient['amount']
+            changed.append(amount)
+    if current:
+        IngredientAmount.objects.filter(
+            id__in=[amount.id for amount in current.values()]
+        ).delete()
+    if changed:
+        IngredientAmount.objects.bulk_update(changed, ('amount',))
+    if new:
+        recipe_amount_ingredients_set(recipe, new)
+    return bool(current or changed or new)
 
 
-def prepare_file(user, ingredients, filename='shopping_list.pdf'):
+def recipe_tags_sync(recipe, tags) -> bool:
     """
-    Формирует объект типа HttpResponse, содержащий файл формата *.pdf со
-    списком и количеством ингредиентов, которые нужно купить.
+    Приводит теги рецепта к переданному списку: добавляет недостающие
+    и удаляет лишние. Возвращает True, если что-то изменилось.
     """
-    filename = 'shopping_list.pdf'
-    create_time = dt.now().strftime('%d.%m.%Y %H:%M')
-    pdf = FPDF()
-    pdf.add_font(
-        'arial',
-        style='',
-        fname='./data/arial.ttf',
-        uni=True
+    through = Recipe.tags.through
+    current = set(
+        through.objects.filter(recipe=recipe).values_list('tag_id', flat=True)
     )
-    pdf.add_page()
-    pdf.set_font('arial', size=13)
-    pdf.cell(
-        200,
-        10,
-        txt=f'Список покупок пользователя: {user.first_name}',
-        ln=1,
-        align="C"
+    tags = {tag.id: tag for tag in tags}
+    removed = current - tags.keys()
+    added = [tag for tag_id, tag in tags.items() if tag_id not in current]
+    if removed:
+        recipe.tags.remove(*removed)
+    if added:
+        recipe.tags.add(*added)
+    return bool(removed or added)
+
+
+def recipes_preview_set(authors, limit=None):
+    """
+    Подгружает одним запросом первые "limit" рецептов (по дате публикации)
+    для каждого автора из переданного списка и сохраняет их в атрибут
+    "recipes_preview". Отбор делается оконной функцией ROW_NUMBER().
+    """
+    authors = list(authors)
+    recipes = Recipe.objects.filter(
+        author__in=[author.id for author in authors]
+    ).only(
+        'id', 'author_id', 'name', 'image', 'image_variants', 'cooking_time',
+        'pub_date'
     )
-    pdf.cell(200, 10, txt=f'{create_time}', ln=1, align='C')
-    table_header = ['Ингредиент', 'Количество', 'Единицы измерения']
-    line_height = pdf.font_size * 2.5
-    col_width = pdf.epw / 3
-
-    for item in table_header:
-        pdf.multi_cell(
-            col_width, line_height, txt=item, border=1, ln=3,
-            max_line_height=pdf.font_size
+    if limit is not None:
+        ranked = recipes.annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=(F('author'),),
+                order_by=F('pub_date').desc(),
+            )
+        ).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE ranked.recipe_rank <= %s '
+            f'ORDER BY ranked.pub_date DESC',
+            (*params, limit),
         )
-    pdf.ln(line_height)
 
-    for item in ingredients:
-        pdf.multi_cell(
-            col_width, line_height, txt=item['ingredient'], border=1, ln=3,
-            max_line_height=pdf.font_size)
-        pdf.multi_cell(
-            col_width,
-            line_height,
-            txt=str(item['sum_amount']),
-            border=1,
-            ln=3,
-            max_line_height=pdf.font_size
+    previews = defaultdict(list)
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = previews[author.id]
+    return authors
+
+
+def recipes_coverage(ingredient_ids):
+    """
+    Рецепты, в которых есть хотя бы один из переданных ингредиентов.
+    Для каждого рецепта считается число его ингредиентов ("total") и сколько
+    из них есть у пользователя ("matched"); сортировка - по убыванию доли
+    имеющихся, затем их количества. Выполняется одним агрегирующим запросом
+    по IngredientAmount: рецепты-кандидаты отбираются по индексу внешнего
+    ключа на ингредиент, а не перебором всех рецептов.
+    """
+    candidates = IngredientAmount.objects.filter(
+        ingredients_id__in=ingredient_ids
+    ).values('recipe_id')
+    return IngredientAmount.objects.filter(
+        recipe_id__in=candidates
+    ).values('recipe_id').annotate(
+        total=Count('id'),
+        matched=Count('id', filter=Q(ingredients_id__in=ingredient_ids)),
+    ).annotate(
+        coverage=ExpressionWrapper(
+            Cast('matched', FloatField()) / F('total'),
+            output_field=FloatField()
         )
-        pdf.multi_cell(
-            col_width, line_height, txt=item['measure'], border=1, ln=3,
-            max_line_height=pdf.font_size)
-        pdf.ln(line_height)
-
-    pdf.cell(
-        200,
-        10,
-        txt='Сформировано в продуктовом помощнике Foodgram',
-        ln=1,
-        align="C"
+    ).order_by('-coverage', '-matched', '-recipe_id')
+
+
+FEED_ORDERING = ('-pub_date', '-recipe_id')
+
+
+def feed_fanout(recipe):
+    """
+    Записывает новый рецепт в ленты подписчиков автора (fan-out on write).
+    Если подписчиков больше settings.FEED_FANOUT_LIMIT, ничего не
+    записывается - такие рецепты подмешиваются при чтении (feed_sources),
+    поэтому стоимость публикации ограничена.
+    """
+    followers_count = User.objects.filter(id=recipe.author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if not followers_count or followers_count > settings.FEED_FANOUT_LIMIT:
+        return
+    followers = User.subscription.through.objects.filter(
+        to_foodgramuser_id=recipe.author_id
+    ).values_list('from_foodgramuser_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date,
+            )
+            for user_id in followers.iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True
     )
-    pdf.output(filename)
 
-    response = HttpResponse(
-        bytes(pdf.output()),
-        content_type='application/pdf; charset=utf-8'
+
+def feed_backfill(author_id, user_ids):
+    """
+    Добавляет в ленты пользователей user_ids settings.FEED_BACKFILL
+    последних рецептов автора.
+    """
+    recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL])
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for recipe_id, pub_date in recipes
+        ),
+        batch_size=1000,
+        ignore_conflicts=True
     )
-    response['Content-Disposition'] = f'attachment; filename={filename}'
 
+
+def feed_follow(user, author):
+    """
+    Добавляет в ленту пользователя последние рецепты автора, на которого
+    он подписался.
+    """
+    if author.followers_count > settings.FEED_FANOUT_LIMIT:
+        return
+    feed_backfill(author.id, (user.id,))
+
+
+def feed_fanout_resume(authors, exclude_user=None):
+    """
+    Вызывается после уменьшения числа подписчиков authors. Рецепты
+    автора, у которого подписчиков стало ровно FEED_FANOUT_LIMIT, больше
+    не подмешиваются при чтении, поэтому последние из них записываются в
+    ленты всех его подписчиков (кроме exclude_user) - иначе рецепты,
+    опубликованные, пока подписчиков было больше, пропали бы из лент.
+    """
+    resumed = authors.filter(
+        followers_count=settings.FEED_FANOUT_LIMIT
+    ).values_list('id', flat=True)
+    for author_id in resumed:
+        followers = User.subscription.through.objects.filter(
+            to_foodgramuser_id=author_id
+        ).exclude(from_foodgramuser_id=exclude_user).values_list(
+            'from_foodgramuser_id', flat=True
+        )
+        feed_backfill(author_id, followers.iterator())
+
+
+def feed_unfollow(user, author):
+    """Убирает из ленты пользователя рецепты автора после отписки."""
+    FeedEntry.objects.filter(user=user, author=author).delete()
+
+
+def feed_sources(user):
+    """
+    Источники ленты подписок пользователя с общими полями FEED_ORDERING:
+    записи самой ленты и рецепты популярных авторов, которые в ленту не
+    записываются (fan-out on read). Страница собирается слиянием
+    источников (см. PageLimitPagination.paginate_keyset).
+    """
+    return (
+        FeedEntry.objects.filter(user=user),
+        Recipe.objects.filter(
+            author__followers=user,
+            author__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+        ).annotate(recipe_id=F('id')),
+    )
+
+
+def cart_version_bump(users):
+    """
+    Увеличивает версию списка покупок у переданных пользователей.
+    Готовые файлы со списком покупок кэшируются по версии, поэтому после
+    изменения корзины они будут сформированы заново.
+    """
+    users.update(cart_version=F('cart_version') + 1)
+
+
+def recipes_version_bump(recipes):
+    """
+    Увеличивает версию у переданных рецептов.
+    Общая для всех пользователей часть рецепта кэшируется по версии
+    (см. FragmentCacheMixin), поэтому после изменения она будет
+    сериализована заново.
+    """
+    recipes.update(version=F('version') + 1)
+
+
+def recipes_changed(recipes):
+    """
+    Меняет версию рецептов, поколение кэша ответов с рецептами и версию
+    списков покупок с этими рецептами. Для изменений в обход сериализатора
+    (админка): вызывается один раз на сохранение, а не на каждую строку
+    ингредиентов.
+    """
+    recipes_version_bump(recipes)
+    reference_version_bump('recipe')
+    cart_version_bump(User.objects.filter(in_cart__in=recipes))
+
+
+def counter_update(queryset, field: str, delta: int) -> None:
+    """
+    Атомарно меняет счётчик "field" у объектов queryset на delta.
+    Счётчик не опускается ниже нуля, даже если успел разойтись с данными
+    (исправляется командой rebuild_counters).
+    """
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def reference_version(name):
+    """Возвращает объект версии справочника (создаёт при отсутствии)."""
+    reference, _ = ReferenceVersion.objects.get_or_create(name=name)
+    return reference
+
+
+def reference_version_bump(name):
+    """Увеличивает версию справочника после его изменения."""
+    reference, created = ReferenceVersion.objects.get_or_create(name=name)
+    if not created:
+        ReferenceVersion.objects.filter(id=reference.id).update(
+            version=F('version') + 1,
+            updated=timezone.now()
+        )
+
+
+def shopping_list_ingredients(user):
+    """
+    Возвращает суммарное количество каждого ингредиента из рецептов,
+    находящихся в списке покупок пользователя.
+    """
+    return IngredientAmount.objects.filter(
+        recipe__in=user.in_cart.values('id')
+    ).values(
+        ingredient=F('ingredients__name'),
+        measure=F('ingredients__measurement_unit')
+    ).order_by(
+        'ingredient'
+    ).annotate(
+        sum_amount=Sum('amount')
+    )
+
+
+def shopping_list_content(user, file_format='pdf'):
+    """
+    Возвращает содержимое файла со списком покупок в формате file_format
+    (один из SHOPPING_LIST_FORMATS).
+    Файл берётся из кэша по ключу (пользователь, версия корзины, формат),
+    при отсутствии - формируется и сохраняется в кэш.
+    """
+    key = f'{user.id}-{user.cart_version}-{file_format}'
+    cache = caches[SHOPPING_LIST_CACHE]
+    content = cache.get(key)
+    if content is None:
+        ingredients = shopping_list_ingredients(user)
+        if file_format in SHOPPING_LIST_STREAMS:
+            _, rows = SHOPPING_LIST_STREAMS[file_format]
+            content = ''.join(rows(ingredients)).encode()
+        else:
+            content = render_shopping_list(user, ingredients)
+        cache.set(key, content)
+    return content
+
+
+def shopping_list_file_response(content, file_format='pdf'):
+    """Оборачивает содержимое файла со списком покупок в HttpResponse."""
+    if file_format in SHOPPING_LIST_STREAMS:
+        content_type, _ = SHOPPING_LIST_STREAMS[file_format]
+    else:
+        content_type = 'application/pdf; charset=utf-8'
+    response = HttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename=shopping_list.{file_format}'
+    )
+    return response
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_csv(ingredients):
+    """Построчно формирует список покупок в формате CSV."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOPPING_LIST_HEADER)
+    for item in ingredients:
+        yield writer.writerow(
+            (item['ingredient'], item['sum_amount'], item['measure'])
+        )
+
+
+def shopping_list_txt(ingredients):
+    """Построчно формирует список покупок простым текстом."""
+    for item in ingredients:
+        yield (
+            f'{item["ingredient"]} ({item["measure"]}) - '
+            f'{item["sum_amount"]}\n'
+        )
+
+
+def shopping_list_json(ingredients):
+    """Построчно формирует список покупок в формате JSON."""
+    separator = '[\n'
+    for item in ingredients:
+        yield separator + json.dumps(
+            {
+                'name': item['ingredient'],
+                'measurement_unit': item['measure'],
+                'amount': item['sum_amount'],
+            },
+            ensure_ascii=False
+        )
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+SHOPPING_LIST_STREAMS = {
+    'csv': ('text/csv; charset=utf-8', shopping_list_csv),
+    'txt': ('text/plain; charset=utf-8', shopping_list_txt),
+    'json': ('application/json; charset=utf-8', shopping_list_json),
+}
+SHOPPING_LIST_FORMATS = ('pdf', *SHOPPING_LIST_STREAMS)
+
+
+def shopping_list_stream_response(user, file_format):
+    """
+    Отдаёт список покупок потоком, по мере чтения строк из базы.
+    Строки читаются через iterator() (на PostgreSQL - серверный курсор),
+    поэтому расход памяти не зависит от размера корзины.
+    """
+    content_type, rows = SHOPPING_LIST_STREAMS[file_format]
+    response = StreamingHttpResponse(
+        rows(shopping_list_ingredients(user).iterator(chunk_size=500)),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename=shopping_list.{file_format}'
+    )
+    return response
+
+
+def shopping_list_response(request, file_format='pdf'):
+    """
+    Формирует ответ с файлом списка покупок.
+    PDF берётся из кэша, остальные форматы отдаются потоком.
+    Заголовок ETag позволяет браузеру не скачивать неизменившийся файл
+    повторно: при совпадении If-None-Match возвращается 304.
+    """
+    user = request.user
+    etag = f'"{user.id}-{user.cart_version}-{file_format}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    elif file_format in SHOPPING_LIST_STREAMS:
+        response = shopping_list_stream_response(user, file_format)
+    else:
+        response = shopping_list_file_response(
+            shopping_list_content(user, file_format)
+        )
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
     return response
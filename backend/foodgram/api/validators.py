@@ -1,7 +1,10 @@
 from string import hexdigits
 
+from django.conf import settings
 from rest_framework.serializers import ValidationError
 
+from .images import image_too_large
+
 
 def class_obj_validate(value: str, klass: object = None) -> object:
     """
@@ -24,6 +27,17 @@ def class_obj_validate(value: str, klass: object = None) -> object:
     return None
 
 
+def class_objs_validate(values: list, klass: object) -> dict:
+    """
+    Проверка списка id одним запросом.
+    Каждое значение должно быть числом; возвращается словарь
+    {id: объект} для существующих объектов переданного класса.
+    """
+    for value in values:
+        class_obj_validate(value=value)
+    return klass.objects.in_bulk([int(value) for value in values])
+
+
 def hex_color_validate(value: str) -> None:
     """
     Проверка соответствия переданного числа шестнадцатиричному формату цвета.
@@ -36,3 +50,20 @@ def hex_color_validate(value: str) -> None:
         raise ValidationError(
             f'{value} не шестнадцатиричное.'
         )
+
+
+def image_validate(file) -> None:
+    """
+    Проверка размера загруженного изображения в байтах и в пикселях.
+    Размер в пикселях берётся из заголовка, прочитанного при проверке
+    ImageField, - само изображение не декодируется.
+    """
+    if file.size > settings.IMAGE_MAX_BYTES:
+        raise ValidationError(
+            f'Размер изображения больше {settings.IMAGE_MAX_BYTES} байт.'
+        )
+    image = getattr(file, 'image', None)
+    if image is not None and image_too_large(*image.size):
+        raise ValidationError(
+            f'Изображение больше {settings.IMAGE_MAX_PIXELS} пикселей.'
+        )
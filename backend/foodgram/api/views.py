@@ -1,28 +1,47 @@
-from django.db.models import F, Sum
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipe.models import Ingredient, IngredientAmount, Recipe, Tag, User
+from recipe.models import (Ingredient, IngredientAmount, Recipe,
+                           ShoppingListJob, Tag, User)
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED
+from rest_framework.status import (HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST,
+                                   HTTP_401_UNAUTHORIZED, HTTP_409_CONFLICT)
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
 from .filters import IngredientFilter, RecipeFilter
-from .mixins import AddDelViewMixin
+from .jobs import enqueue_shopping_list_job
+from .mixins import (AddDelViewMixin, AnonymousCacheMixin, FragmentCacheMixin,
+                     ReferenceCacheMixin, SubscriptionsContextMixin)
 from .paginators import PageLimitPagination
+from .parsers import RecipeFormParser, RecipeMultiPartParser
 from .permissions import AdminOrReadOnly, AuthorAdminOrReadOnly
-from .serializers import (IngredientSerializer, RecipeSerializer,
-                          RecipeShortSerializer, TagSerializer,
-                          UserFollowsSerializer)
-from .utils import prepare_file
+from .renderers import (CSVRenderer, FileFormatNegotiation, PDFRenderer,
+                        PlainTextRenderer)
+from .search import ingredient_prefix_index, search_ingredients
+from .serializers import (IngredientSerializer, RecipeCoverageSerializer,
+                          RecipeFragmentSerializer, RecipeSerializer,
+                          RecipeShortSerializer, ShoppingListJobSerializer,
+                          TagSerializer, UserFollowsSerializer)
+from .utils import (FEED_ORDERING, SHOPPING_LIST_FORMATS, feed_sources,
+                    recipes_coverage, recipes_preview_set,
+                    recipes_version_bump, reference_version_bump,
+                    shopping_list_file_response, shopping_list_response)
+from .validators import class_obj_validate
 
 
-class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
+class UserViewSet(SubscriptionsContextMixin, DjoserUserViewSet,
+                  AddDelViewMixin):
     """
     ViewSet для работы с пользователми.
     Авторизованные пользователи имеют возможность подписаться на автора
     рецепта.
     """
     pagination_class = PageLimitPagination
+    cursor_ordering = ('username', 'id')
     add_serializer = UserFollowsSerializer
 
     @action(methods=('GET', 'POST', 'DELETE'), detail=True)
@@ -36,8 +55,16 @@ class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
         user = self.request.user
         if not user.is_authenticated:
             return Response(status=HTTP_401_UNAUTHORIZED)
-        authors = User.objects.filter(followers=user)
-        pages = self.paginate_queryset(authors)
+        limit = request.query_params.get('recipes_limit')
+        if limit:
+            class_obj_validate(value=limit)
+            limit = int(limit)
+        else:
+            limit = None
+        authors = User.objects.filter(followers=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
+        pages = recipes_preview_set(self.paginate_queryset(authors), limit)
         serializer = UserFollowsSerializer(
             pages,
             many=True,
@@ -46,32 +73,165 @@ class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, ReadOnlyModelViewSet):
     """Вьюсет для работы с тэгами."""
+    reference_name = 'tag'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AdminOrReadOnly,)
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, ReadOnlyModelViewSet):
     """Вьюсет для работы с ингредиентами."""
+    reference_name = 'ingredient'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AdminOrReadOnly,)
     pagination_class = None
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        """
+        Список ингредиентов.
+        Поиск по началу названия ("?name=") выполняется по индексу в памяти,
+        без запроса к базе. Поиск с учётом опечаток и по любому слову
+        названия ("?search=") возвращает результаты по убыванию сходства.
+        """
+        search = request.query_params.get('search', '').strip()
+        if search:
+            return Response(search_ingredients(search))
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_prefix_index.get().search(name))
+        return super().list(request, *args, **kwargs)
+
 
-class RecipeViewSet(ModelViewSet, AddDelViewMixin):
-    """Вьюсет для работы с рецептами."""
+class RecipeViewSet(AnonymousCacheMixin, FragmentCacheMixin, ModelViewSet,
+                    AddDelViewMixin):
+    """
+    Вьюсет для работы с рецептами.
+    Ответы списка и отдельного рецепта для анонимных пользователей
+    кэшируются до изменения рецептов, тегов, ингредиентов или авторов.
+    Для остальных пользователей из кэша берётся общая часть каждого рецепта,
+    а персональные флаги дополняются отдельными запросами на страницу.
+    Рецепт принимается в JSON или application/x-www-form-urlencoded
+    (изображение в base64) или в multipart/form-data (изображение файлом).
+    """
+    cache_generation = 'recipe'
+    fragment_prefix = 'recipe'
+    fragment_serializer_class = RecipeFragmentSerializer
     queryset = Recipe.objects.select_related('author')
     serializer_class = RecipeSerializer
     add_serializer = RecipeShortSerializer
     permission_classes = (AuthorAdminOrReadOnly,)
+    parser_classes = (JSONParser, RecipeFormParser, RecipeMultiPartParser)
     pagination_class = PageLimitPagination
+    cursor_ordering = ('-pub_date', '-id')
     filterset_class = RecipeFilter
 
+    thumbnail_actions = ('list', 'feed')
+
+    def get_fragment_prefix(self):
+        if self.action in self.thumbnail_actions:
+            return f'{self.fragment_prefix}:list'
+        return self.fragment_prefix
+
+    def get_serializer_context(self):
+        """Списки рецептов отдают миниатюру вместо оригинала изображения."""
+        context = super().get_serializer_context()
+        if self.action in self.thumbnail_actions:
+            context['image_variant'] = 'thumbnail'
+        return context
+
+    def get_fragment_prefetch(self):
+        """Теги и ингредиенты с количеством - одним запросом на страницу."""
+        return (
+            'tags',
+            Prefetch(
+                'ingredient',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredients'
+                ).order_by('ingredients__name'),
+            ),
+        )
+
+    def get_queryset(self):
+        """
+        Для списка и отдельного рецепта связанные объекты подгружаются
+        только для рецептов, которых нет в кэше (см. FragmentCacheMixin).
+        В остальных случаях рецепты аннотируются флагами "is_favorited" и
+        "is_in_shopping_cart" для текущего пользователя, чтобы не делать
+        запрос на каждый рецепт.
+        """
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            return queryset
+        queryset = queryset.prefetch_related(*self.get_fragment_prefetch())
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(
+                Recipe.favorite.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    foodgramuser_id=user.id,
+                )
+            ),
+            is_in_shopping_cart=Exists(
+                Recipe.shopping_cart.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    foodgramuser_id=user.id,
+                )
+            ),
+        )
+
+    def overlay(self, data, recipes):
+        """
+        Добавляет "is_favorited", "is_in_shopping_cart" и
+        "author.is_subscribed" - по одному запросу на флаг для всей
+        страницы.
+        """
+        user = self.request.user
+        favorited = in_cart = subscriptions = set()
+        if user.is_authenticated and recipes:
+            ids = [recipe.id for recipe in recipes]
+            favorited = set(Recipe.favorite.through.objects.filter(
+                foodgramuser_id=user.id, recipe_id__in=ids
+            ).values_list('recipe_id', flat=True))
+            in_cart = set(Recipe.shopping_cart.through.objects.filter(
+                foodgramuser_id=user.id, recipe_id__in=ids
+            ).values_list('recipe_id', flat=True))
+            subscriptions = set(user.subscription.filter(
+                id__in={recipe.author_id for recipe in recipes}
+            ).values_list('id', flat=True))
+        for item in data:
+            author_id = item['author']['id']
+            item['author'] = {
+                **item['author'],
+                'is_subscribed': (
+                    author_id in subscriptions and author_id != user.id
+                ),
+            }
+            item['is_favorited'] = item['id'] in favorited
+            item['is_in_shopping_cart'] = item['id'] in in_cart
+        return data
+
+    def perform_update(self, serializer):
+        """
+        Сохраняет рецепт. Ингредиенты обновляются bulk-операциями без
+        сигналов, поэтому версия рецепта и поколение кэша меняются здесь.
+        """
+        serializer.save()
+        if serializer.changed:
+            recipes_version_bump(
+                Recipe.objects.filter(id=serializer.instance.id)
+            )
+            reference_version_bump(self.cache_generation)
+
     @action(methods=('GET', 'POST', 'DELETE'), detail=True)
     def favorite(self, request, pk):
         """Добавляет/удалет рецепт в избранное текущему пользователю."""
@@ -82,23 +242,175 @@ class RecipeViewSet(ModelViewSet, AddDelViewMixin):
         """Добавляет/удалет рецепт в список покупок текущего пользователя."""
         return self.add_del_obj(pk, 'shopping_cart')
 
-    @action(methods=('get',), detail=False)
+    @action(
+        methods=('GET',),
+        detail=False,
+        permission_classes=(IsAdminUser,)
+    )
+    def cache_stats(self, request):
+        """Счётчики попаданий и промахов кэша ответов (для администратора)."""
+        return Response(self.cache_counters())
+
+    @action(methods=('GET',), detail=False)
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан текущий пользователь,
+        от новых к старым. Всегда отдаётся с пагинацией по ключу
+        ("?cursor=").
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        paginator = PageLimitPagination()
+        entries = paginator.paginate_keyset(
+            feed_sources(user), FEED_ORDERING, request
+        )
+        recipes = Recipe.objects.select_related('author').in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        page = [
+            recipes[entry.recipe_id] for entry in entries
+            if entry.recipe_id in recipes
+        ]
+        return paginator.get_paginated_response(self.get_fragments(page))
+
+    @action(methods=('GET',), detail=False)
+    def can_cook(self, request):
+        """
+        Подбирает рецепты по имеющимся ингредиентам.
+        id ингредиентов передаются параметром "ingredients" (повторяющимся
+        или через запятую). Рецепты отсортированы по доле имеющихся
+        ингредиентов; для каждого указано, чего не хватает.
+        """
+        values = [
+            value
+            for param in request.query_params.getlist('ingredients')
+            for value in param.split(',') if value
+        ]
+        if not values:
+            return Response(status=HTTP_400_BAD_REQUEST)
+        for value in values:
+            class_obj_validate(value=value)
+        ingredient_ids = {int(value) for value in values}
+
+        paginator = PageLimitPagination()
+        rows = paginator.paginate_queryset(
+            recipes_coverage(ingredient_ids), request
+        )
+        recipes = Recipe.objects.filter(
+            id__in=[row['recipe_id'] for row in rows]
+        ).prefetch_related(
+            Prefetch(
+                'ingredient',
+                IngredientAmount.objects.select_related('ingredients')
+                .order_by('ingredients__name'),
+            ),
+        ).in_bulk()
+        results = []
+        for row in rows:
+            recipe = recipes[row['recipe_id']]
+            recipe.total = row['total']
+            recipe.matched = row['matched']
+            results.append(recipe)
+        serializer = RecipeCoverageSerializer(
+            results,
+            many=True,
+            context={'request': request, 'ingredient_ids': ingredient_ids}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        methods=('get',),
+        detail=False,
+        renderer_classes=(
+            JSONRenderer, PDFRenderer, CSVRenderer, PlainTextRenderer
+        )
+    )
     def download_shopping_cart(self, request):
-        """Загружает файл shopping_list.pdf со списком ингредиентов."""
+        """
+        Загружает файл со списком ингредиентов.
+        Формат задаётся параметром "format": pdf (по умолчанию), csv, txt
+        или json.
+        """
         user = self.request.user
         if not user.is_authenticated:
             return Response(status=HTTP_401_UNAUTHORIZED)
+        file_format = request.query_params.get('format', 'pdf')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(status=HTTP_400_BAD_REQUEST)
+        if not user.in_cart.exists():
+            return Response(status=HTTP_400_BAD_REQUEST)
+        return shopping_list_response(request, file_format)
+
+    @action(
+        methods=('POST',),
+        detail=False,
+        url_path='download_shopping_cart/jobs',
+        url_name='shopping-list-jobs',
+        content_negotiation_class=FileFormatNegotiation
+    )
+    def shopping_list_jobs(self, request):
+        """
+        Ставит в очередь формирование файла со списком покупок.
+        Для больших списков: файл формируется в фоне, клиент опрашивает
+        задачу и забирает готовый файл по ссылке из поля "file". Формат
+        файла задаётся параметром "format", как у download_shopping_cart.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        file_format = request.query_params.get('format', 'pdf')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(status=HTTP_400_BAD_REQUEST)
         if not user.in_cart.exists():
             return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = IngredientAmount.objects.filter(
-            recipe__in=user.in_cart.values('id')
-        ).values(
-            ingredient=F('ingredients__name'),
-            measure=F('ingredients__measurement_unit')
-        ).order_by(
-            'ingredient'
-        ).annotate(
-            sum_amount=Sum('amount')
+        job = enqueue_shopping_list_job(user, file_format)
+        serializer = ShoppingListJobSerializer(
+            job,
+            context={'request': request}
+        )
+        return Response(serializer.data, status=HTTP_202_ACCEPTED)
+
+    @action(
+        methods=('GET',),
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)',
+        url_name='shopping-list-job'
+    )
+    def shopping_list_job(self, request, job_id):
+        """Состояние задачи на формирование списка покупок."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        job = get_object_or_404(
+            user.shopping_list_jobs.defer('content'),
+            id=job_id
         )
+        serializer = ShoppingListJobSerializer(
+            job,
+            context={'request': request}
+        )
+        return Response(serializer.data)
 
-        return prepare_file(user, ingredients)
+    @action(
+        methods=('GET',),
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)/file',
+        url_name='shopping-list-job-file'
+    )
+    def shopping_list_job_file(self, request, job_id):
+        """
+        Загружает файл, сформированный задачей. Если список покупок
+        изменился после формирования файла, файл не отдаётся - нужна
+        новая задача.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return Response(status=HTTP_401_UNAUTHORIZED)
+        job = get_object_or_404(user.shopping_list_jobs, id=job_id)
+        if (job.status != ShoppingListJob.Status.DONE
+                or job.cart_version != user.cart_version):
+            return Response(status=HTTP_409_CONFLICT)
+        return shopping_list_file_response(
+            bytes(job.content), job.file_format
+        )
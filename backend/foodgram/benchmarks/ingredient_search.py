@@ -0,0 +1,113 @@
+"""
+Бенчмарк поиска ингредиентов по индексам в памяти (api.search).
+
+Индексы строятся из data/ingredients.json и сравниваются с полным
+перебором списка: по началу названия (PrefixIndex) и с учётом опечаток
+(TrigramIndex).
+
+Запуск из каталога backend/foodgram:
+    python benchmarks/ingredient_search.py --data ../../data/ingredients.json
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from timeit import repeat
+
+import django
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+django.setup()
+
+from api.search import PrefixIndex, TrigramIndex, trigrams  # noqa: E402
+
+PREFIXES = ('а', 'абр', 'мол', 'сахар', 'Соль', 'я')
+QUERIES = ('абрикс', 'варенье', 'сахр', 'малако', 'соль гимал', 'куриное')
+LIMIT = 20
+THRESHOLD = 0.6
+
+
+def scan_prefix(rows, prefix):
+    """Полный перебор: начало названия без учёта регистра."""
+    prefix = prefix.casefold()
+    return sorted(
+        (row for row in rows if row['name'].casefold().startswith(prefix)),
+        key=lambda row: (row['name'], row['id'])
+    )
+
+
+def scan_trigram(rows, query):
+    """Полный перебор: триграммы считаются для каждого названия."""
+    grams = trigrams(query)
+    ranked = []
+    for row in rows:
+        name_grams = trigrams(row['name'])
+        count = len(grams & name_grams)
+        if count < THRESHOLD * len(grams):
+            continue
+        similarity = count / len(grams | name_grams)
+        ranked.append((-count, -similarity, row['name'], row['id'], row))
+    ranked.sort(key=lambda item: item[:4])
+    return [item[4] for item in ranked[:LIMIT]]
+
+
+def measure(function, arguments, number):
+    """Среднее время одного вызова в микросекундах (лучшее из серий)."""
+    best = min(repeat(
+        lambda: [function(argument) for argument in arguments],
+        number=number, repeat=5
+    ))
+    return best / number / len(arguments) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--data', default='../../data/ingredients.json')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.data, encoding='utf-8') as file:
+        rows = [
+            {'id': number, **row}
+            for number, row in enumerate(json.load(file), start=1)
+        ]
+    prefix_index = PrefixIndex(rows)
+    trigram_index = TrigramIndex(rows)
+
+    for prefix in PREFIXES:
+        assert prefix_index.search(prefix) == scan_prefix(rows, prefix)
+    for query in QUERIES:
+        assert (trigram_index.search(query, LIMIT, THRESHOLD)
+                == scan_trigram(rows, query))
+        names = [
+            row['name']
+            for row in trigram_index.search(query, 3, THRESHOLD)
+        ]
+        print(f'{query!r}: {names}')
+
+    print(f'\nингредиентов: {len(rows)}')
+    print(f'{"поиск":<22} {"перебор, мкс":>13} {"индекс, мкс":>12}')
+    results = (
+        (
+            'по началу названия',
+            measure(lambda p: scan_prefix(rows, p), PREFIXES, args.number),
+            measure(prefix_index.search, PREFIXES, args.number),
+        ),
+        (
+            'с опечатками',
+            measure(lambda q: scan_trigram(rows, q), QUERIES, 1),
+            measure(
+                lambda q: trigram_index.search(q, LIMIT, THRESHOLD),
+                QUERIES, args.number
+            ),
+        ),
+    )
+    for name, scan, index in results:
+        print(f'{name:<22} {scan:>13.1f} {index:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
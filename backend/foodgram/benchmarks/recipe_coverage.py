@@ -0,0 +1,170 @@
+"""
+Бенчмарк подбора рецептов по имеющимся ингредиентам (api.utils
+.recipes_coverage) на синтетической базе из 100 000 рецептов.
+
+Сравнивает один агрегирующий запрос с подходом "по запросу на рецепт"
+(замеряется на выборке рецептов и пересчитывается на всю базу) и с
+загрузкой всех пар рецепт-ингредиент для подсчёта в Python.
+
+Используется тестовая база из настроек проекта (DB_ENGINE, DB_NAME...);
+миграции читают ./data/ingredients.json, поэтому --root должен указывать
+на каталог с data/. Запуск из каталога backend/foodgram:
+    python benchmarks/recipe_coverage.py --root ../.. --keepdb
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from time import perf_counter
+
+import django
+from django.db.models import Count
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+django.setup()
+
+from api.utils import recipes_coverage  # noqa: E402
+from django.db import connection  # noqa: E402
+from recipe.models import (Ingredient, IngredientAmount, Recipe,  # noqa: E402
+                           User)
+
+PANTRY_SIZES = (3, 10, 30)
+PAGE = 6
+SAMPLE = 500
+
+
+def populate(count, seed):
+    """Создаёт count рецептов по 5-12 случайных ингредиентов в каждом."""
+    if Recipe.objects.count() >= count:
+        return
+    rng = random.Random(seed)
+    author, _ = User.objects.get_or_create(
+        username='benchmark', defaults={'email': 'benchmark@example.com'}
+    )
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    # Частота ингредиентов неравномерна, как в настоящих рецептах.
+    weights = [1 / (rank + 1) for rank in range(len(ingredient_ids))]
+    start = Recipe.objects.count()
+    batch = 5000
+    for offset in range(start, count, batch):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'рецепт {number}', text='текст',
+                cooking_time=10, image='recipe_images/benchmark.png'
+            )
+            for number in range(offset, min(offset + batch, count))
+        )
+        amounts = []
+        for recipe in recipes:
+            chosen = set()
+            while len(chosen) < rng.randint(5, 12):
+                chosen.add(rng.choices(ingredient_ids, weights)[0])
+            amounts.extend(
+                IngredientAmount(
+                    recipe_id=recipe.id, ingredients_id=ingredient_id,
+                    amount=rng.randint(1, 500)
+                )
+                for ingredient_id in chosen
+            )
+        IngredientAmount.objects.bulk_create(amounts, batch_size=batch)
+        print(f'создано рецептов: {offset + len(recipes)}', file=sys.stderr)
+
+
+def timed(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+
+def aggregate(pantry):
+    """Первая страница и общее количество - два запроса."""
+    rows = recipes_coverage(pantry)
+    return list(rows[:PAGE]), rows.count()
+
+
+def per_recipe(pantry, recipe_ids):
+    """Прежний подход: ингредиенты каждого рецепта отдельным запросом."""
+    ranked = []
+    for recipe_id in recipe_ids:
+        ingredients = set(IngredientAmount.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredients_id', flat=True))
+        matched = len(ingredients & pantry)
+        if matched:
+            ranked.append((matched / len(ingredients), matched, recipe_id))
+    return sorted(ranked, reverse=True)[:PAGE]
+
+
+def in_python(pantry):
+    """Все пары рецепт-ингредиент одним запросом, подсчёт в Python."""
+    total, matched = Counter(), defaultdict(int)
+    for recipe_id, ingredient_id in IngredientAmount.objects.values_list(
+        'recipe_id', 'ingredients_id'
+    ).order_by().iterator(chunk_size=10000):
+        total[recipe_id] += 1
+        if ingredient_id in pantry:
+            matched[recipe_id] += 1
+    ranked = sorted(
+        (
+            (count / total[recipe_id], count, recipe_id)
+            for recipe_id, count in matched.items()
+        ),
+        reverse=True
+    )
+    return ranked[:PAGE], len(ranked)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', default='../..')
+    parser.add_argument('--recipes', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--keepdb', action='store_true',
+        help='не удалять тестовую базу (повторный запуск без заполнения)'
+    )
+    args = parser.parse_args()
+
+    os.chdir(args.root)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, keepdb=args.keepdb
+    )
+    try:
+        populate(args.recipes, args.seed)
+        recipe_ids = list(
+            Recipe.objects.order_by('?').values_list('id', flat=True)[:SAMPLE]
+        )
+        total = Recipe.objects.count()
+        popular = list(
+            IngredientAmount.objects.values('ingredients_id').annotate(
+                uses=Count('id')
+            ).order_by('-uses').values_list('ingredients_id', flat=True)[:60]
+        )
+        rng = random.Random(args.seed)
+        print(
+            f'{connection.vendor}, рецептов: {total}\n'
+            f'{"ингр.":>6} {"найдено":>8} {"агрегат, мс":>12} '
+            f'{"python, мс":>11} {"по рецепту, мс":>15}'
+        )
+        for size in PANTRY_SIZES:
+            pantry = set(rng.sample(popular, size))
+            (_, found), fast = timed(lambda: aggregate(pantry))
+            _, python = timed(lambda: in_python(pantry))
+            _, slow = timed(lambda: per_recipe(pantry, recipe_ids))
+            slow *= total / len(recipe_ids)
+            print(
+                f'{size:>6} {found:>8} {fast * 1000:>12.1f} '
+                f'{python * 1000:>11.1f} {slow * 1000:>15.0f}'
+            )
+    finally:
+        if not args.keepdb:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
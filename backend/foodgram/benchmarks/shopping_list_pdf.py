@@ -0,0 +1,117 @@
+"""
+Микробенчмарк формирования pdf-файла со списком покупок.
+
+Сравнивает api.pdf.render_shopping_list с прежней реализацией
+api.utils.prepare_file (её копия - функция legacy_prepare_file ниже).
+
+Запуск из каталога backend/foodgram:
+    python benchmarks/shopping_list_pdf.py --font ../../data/arial.ttf
+"""
+import argparse
+import os
+import sys
+import tempfile
+import warnings
+from pathlib import Path
+from timeit import repeat
+from types import SimpleNamespace
+
+from fpdf import FPDF
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.pdf import render_shopping_list  # noqa: E402
+
+
+def legacy_prepare_file(user, ingredients, font_path, filename):
+    """Прежняя реализация: разбор шрифта, запись на диск, два рендера."""
+    pdf = FPDF()
+    pdf.add_font('arial', style='', fname=font_path)
+    pdf.add_page()
+    pdf.set_font('arial', size=13)
+    pdf.cell(
+        200, 10, f'Список покупок пользователя: {user.first_name}',
+        ln=1, align='C'
+    )
+    pdf.cell(200, 10, 'дата', ln=1, align='C')
+    line_height = pdf.font_size * 2.5
+    col_width = pdf.epw / 3
+    for item in ('Ингредиент', 'Количество', 'Единицы измерения'):
+        pdf.multi_cell(
+            col_width, line_height, item, border=1, ln=3,
+            max_line_height=pdf.font_size
+        )
+    pdf.ln(line_height)
+    for item in ingredients:
+        for text in (
+            item['ingredient'], str(item['sum_amount']), item['measure']
+        ):
+            pdf.multi_cell(
+                col_width, line_height, text, border=1, ln=3,
+                max_line_height=pdf.font_size
+            )
+        pdf.ln(line_height)
+    pdf.cell(
+        200, 10, 'Сформировано в продуктовом помощнике Foodgram',
+        ln=1, align='C'
+    )
+    pdf.output(filename)
+    return bytes(pdf.output())
+
+
+def make_ingredients(count):
+    """Синтетическая корзина; каждое пятое название переносится."""
+    return [
+        {
+            'ingredient': (
+                f'ингредиент {number} '
+                + 'с очень длинным названием ' * (number % 5 == 0) * 3
+            ),
+            'sum_amount': number * 10,
+            'measure': 'г',
+        }
+        for number in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--font', default='../../data/arial.ttf')
+    parser.add_argument('--sizes', default='10,100,500')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', DeprecationWarning)
+
+    user = SimpleNamespace(first_name='Тест')
+    font = os.path.abspath(args.font)
+    render_shopping_list(user, [], font_path=font)
+
+    print(
+        f'{"строк":>6} {"прежний, мс":>12} {"новый, мс":>10} '
+        f'{"ускорение":>10}'
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'shopping_list.pdf')
+        for size in map(int, args.sizes.split(',')):
+            ingredients = make_ingredients(size)
+            legacy = min(repeat(
+                lambda: legacy_prepare_file(
+                    user, ingredients, font, filename
+                ),
+                number=1, repeat=args.repeat
+            ))
+            current = min(repeat(
+                lambda: render_shopping_list(
+                    user, ingredients, font_path=font
+                ),
+                number=1, repeat=args.repeat
+            ))
+            print(
+                f'{size:>6} {legacy * 1000:>12.1f} {current * 1000:>10.1f} '
+                f'{legacy / current:>9.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
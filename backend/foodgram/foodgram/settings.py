@@ -78,6 +78,80 @@ DATABASES = {
     }
 }
 
+"""
+Кэш готовых файлов со списком покупок.
+Файлы хранятся на диске и общие для всех воркеров gunicorn; при переполнении
+старые записи вытесняются.
+"""
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shopping_lists': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv(
+            'SHOPPING_LIST_CACHE_DIR',
+            default=os.path.join(BASE_DIR, 'cache', 'shopping_lists')
+        ),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'recipes': {
+        'BACKEND': os.getenv(
+            'RECIPE_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RECIPE_CACHE_LOCATION', default='recipes'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+#  Кэш ответов со списком рецептов и рецептами для анонимных пользователей
+#  (имя кэша из CACHES). Записи сбрасываются сменой поколения при изменении
+#  данных, TIMEOUT лишь ограничивает время хранения устаревших записей
+RECIPE_CACHE = 'recipes'
+
+#  Лента подписок: рецепт автора, у которого не больше FEED_FANOUT_LIMIT
+#  подписчиков, записывается в ленту каждого подписчика при публикации;
+#  рецепты более популярных авторов подмешиваются при чтении ленты. При
+#  подписке в ленту добавляются FEED_BACKFILL последних рецептов автора
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+FEED_BACKFILL = 50
+
+#  Фоновое формирование списков покупок: число потоков в каждом процессе и
+#  сколько последних задач хранить для пользователя
+SHOPPING_LIST_JOB_WORKERS = int(os.getenv('SHOPPING_LIST_JOB_WORKERS', 2))
+SHOPPING_LIST_JOB_KEEP = 5
+
+#  Изображения рецептов: наибольший размер файла в байтах и в пикселях
+#  (ширина * высота) - проверяются до декодирования. Варианты (формат и
+#  наибольшая ширина) строятся в фоне пулом из IMAGE_VARIANT_WORKERS
+#  потоков; списки рецептов отдают вариант "thumbnail"
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 5 * 1024 * 1024))
+IMAGE_MAX_PIXELS = 25_000_000
+IMAGE_VARIANTS = {
+    'thumbnail': ('JPEG', 480),
+    'thumbnail_webp': ('WEBP', 480),
+    'webp': ('WEBP', 1600),
+}
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+
+#  Изображение в base64 на треть больше самого файла, плюс остальные поля
+#  рецепта
+DATA_UPLOAD_MAX_MEMORY_SIZE = IMAGE_MAX_BYTES * 4 // 3 + 1024 * 1024
+
+#  Поиск ингредиентов с опечатками: сколько результатов возвращать и
+#  минимальная доля совпавших триграмм запроса (для индекса в памяти; на
+#  PostgreSQL порог задаёт pg_trgm.word_similarity_threshold, по умолчанию 0.6)
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_THRESHOLD = 0.6
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': ('django.contrib.auth.password_validation.'
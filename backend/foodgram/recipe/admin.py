@@ -1,3 +1,4 @@
+from api.utils import recipes_changed
 from django.contrib.admin import ModelAdmin, TabularInline, register
 from django.utils.safestring import mark_safe
 
@@ -12,20 +13,44 @@ class IngredientAdmin(ModelAdmin):
     """Класс настройки вида админки для ингредиентов."""
     list_display = ('name', 'measurement_unit')
     search_fields = ('name', )
-    list_filter = ('name', )
+    show_full_result_count = False
     empty_value_display = EMPTY_VAL_PLACEHOLDER
     save_on_top = True
 
 
 @register(IngredientAmount)
 class IngredientAmountAdmin(ModelAdmin):
-    """Класс настройки вида админки для количества ингредиентов."""
-    pass
+    """
+    Класс настройки вида админки для количества ингредиентов.
+    Изменения меняют версии затронутых рецептов (см. recipes_changed).
+    """
+    list_display = ('recipe', 'ingredients', 'amount')
+    list_select_related = ('recipe', 'ingredients')
+    raw_id_fields = ('recipe', )
+    autocomplete_fields = ('ingredients', )
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        recipes_changed(Recipe.objects.filter(id__in=recipe_ids))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recipes_changed(Recipe.objects.filter(id=obj.recipe_id))
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        recipes_changed(Recipe.objects.filter(id__in=recipe_ids))
 
 
 class IngredientInline(TabularInline):
     """Класс настройки виджета отображения количества ингредиентов."""
     model = IngredientAmount
+    autocomplete_fields = ('ingredients', )
     extra = 1
 
 
@@ -45,16 +70,24 @@ class RecipeAdmin(ModelAdmin):
         ('text', )
     )
     raw_id_fields = ('author', )
-    list_filter = (
-        'name',
-        'author__username',
-        'tags'
-    )
-    search_fields = ('name', 'author')
+    list_select_related = ('author', )
+    list_filter = ('tags', )
+    search_fields = ('name', 'author__username')
+    show_full_result_count = False
     save_on_top = True
     empty_value_display = EMPTY_VAL_PLACEHOLDER
     inlines = (IngredientInline, )
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Ингредиенты и теги сохраняются после рецепта, поэтому версии
+        рецепта, кэша и списков покупок меняются ещё раз - один раз на
+        сохранение, а не на каждую строку ингредиентов.
+        """
+        super().save_related(request, form, formsets, change)
+        if change:
+            recipes_changed(Recipe.objects.filter(id=form.instance.id))
+
     def getimage(self, obj):
         return mark_safe(f'<img src={obj.image.url} width="80" height="35"')
 
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipe.models import Recipe, User
+
+
+def related_count(queryset, key: str):
+    """Подзапрос "количество строк queryset, где key = pk объекта"."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{key: OuterRef('pk')}).order_by().values(
+                key
+            ).annotate(total=Count('*')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count',
+     lambda: related_count(Recipe.favorite.through.objects, 'recipe_id')),
+    (Recipe, 'in_cart_count',
+     lambda: related_count(Recipe.shopping_cart.through.objects, 'recipe_id')),
+    (User, 'recipes_count',
+     lambda: related_count(Recipe.objects, 'author_id')),
+    (User, 'followers_count',
+     lambda: related_count(
+         User.subscription.through.objects, 'to_foodgramuser_id'
+     )),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, списков покупок, рецептов и '
+        'подписчиков. С --check только проверяет их.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Не исправлять, завершиться с ошибкой при расхождениях.'
+        )
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        with transaction.atomic():
+            for model, field, actual in COUNTERS:
+                wrong = model.objects.annotate(actual=actual()).exclude(
+                    **{field: F('actual')}
+                )
+                count = wrong.count()
+                mismatched += count
+                self.stdout.write(
+                    f'{model.__name__}.{field}: расхождений {count}'
+                )
+                if count and not options['check']:
+                    model.objects.filter(
+                        id__in=wrong.values('id')
+                    ).update(**{field: actual()})
+        if options['check'] and mismatched:
+            raise CommandError(f'Счётчики расходятся: {mismatched}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,37 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+def create_trgm_index(apps, schema_editor):
+    """
+    GIN-индекс триграмм по названию ингредиента для поиска с опечатками.
+    Создаётся только на PostgreSQL: на остальных СУБД поиск выполняется по
+    индексу в памяти приложения.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_ingredient_name_trgm '
+        'ON recipe_ingredient USING gin (name gin_trgm_ops)'
+    )
+
+
+def drop_trgm_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_ingredient_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0003_shoppinglistjob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(
+            create_trgm_index,
+            drop_trgm_index
+        )
+    ]
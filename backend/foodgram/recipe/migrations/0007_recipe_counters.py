@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def related_count(queryset, key):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{key: OuterRef('pk')}).order_by().values(
+                key
+            ).annotate(total=Count('*')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    User = apps.get_model('users', 'FoodgramUser')
+    Recipe.objects.update(
+        favorites_count=related_count(
+            Recipe.favorite.through.objects, 'recipe_id'
+        ),
+        in_cart_count=related_count(
+            Recipe.shopping_cart.through.objects, 'recipe_id'
+        ),
+    )
+    User.objects.update(
+        recipes_count=related_count(Recipe.objects, 'author_id'),
+        followers_count=related_count(
+            User.subscription.through.objects, 'to_foodgramuser_id'
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_foodgramuser_counters'),
+        ('recipe', '0006_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное, раз'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в список покупок, раз'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
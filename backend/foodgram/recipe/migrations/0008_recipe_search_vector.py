@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def create_search_vector(apps, schema_editor):
+    """
+    Хранимый (генерируемый) столбец с поисковым вектором рецепта и
+    GIN-индекс по нему. Название весит больше описания. Создаётся только на
+    PostgreSQL (нужна версия 12+): на остальных СУБД поиск выполняется
+    через icontains (см. api.search.search_recipes).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE recipe_recipe ADD COLUMN IF NOT EXISTS search_vector '
+        'tsvector GENERATED ALWAYS AS ('
+        "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+        ') STORED'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_recipe_search_vector '
+        'ON recipe_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE recipe_recipe DROP COLUMN IF EXISTS search_vector'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_search_vector,
+            drop_search_vector
+        )
+    ]
@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db.models import (CASCADE, CharField, DateTimeField, ForeignKey,
-                              ImageField, ManyToManyField, Model,
-                              PositiveIntegerField, SlugField, TextField,
+from django.db.models import (CASCADE, BinaryField, CharField, DateTimeField,
+                              ForeignKey, ImageField, Index, JSONField,
+                              ManyToManyField, Model, PositiveIntegerField,
+                              SlugField, TextChoices, TextField,
                               UniqueConstraint)
 
 User = get_user_model()
@@ -130,6 +131,7 @@ class Recipe(Model):
     image = ImageField(
         verbose_name='Изображение',
         upload_to='recipe_images/',
+        db_index=True,
     )
     name = CharField(
         verbose_name='Название рецепта',
@@ -152,17 +154,48 @@ class Recipe(Model):
     text = TextField(
         verbose_name='Описание рецепта',
     )
+    favorites_count = PositiveIntegerField(
+        verbose_name='Добавлено в избранное, раз',
+        default=0,
+        editable=False
+    )
+    in_cart_count = PositiveIntegerField(
+        verbose_name='Добавлено в список покупок, раз',
+        default=0,
+        editable=False
+    )
+    version = PositiveIntegerField(
+        verbose_name='Версия',
+        help_text='Меняется при каждом изменении рецепта, его тегов, '
+                  'ингредиентов или автора',
+        default=0,
+        editable=False
+    )
+    image_variants = JSONField(
+        verbose_name='Варианты изображения',
+        help_text='Уменьшенные копии изображения, строятся в фоне',
+        default=dict,
+        blank=True,
+        editable=False
+    )
 
     def _get_count_added_to_favorite(self):
-        return self.favorite.count()
+        return self.favorites_count
 
     _get_count_added_to_favorite.short_description = ('Добавлено в избранное'
                                                       ', раз')
+    _get_count_added_to_favorite.admin_order_field = 'favorites_count'
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            Index(
+                name='recipe_pub_date_id_idx',
+                fields=('-pub_date', '-id')
+            ),
+        )
         constraints = (
             UniqueConstraint(
                 name='unique_per_author',
@@ -172,3 +205,149 @@ class Recipe(Model):
 
     def __str__(self) -> str:
         return self.name
+
+
+class ShoppingListJob(Model):
+    """
+    Модель задачи на формирование файла со списком покупок в фоне.
+    Готовый файл хранится в самой задаче, поэтому забрать его можно через
+    любой воркер приложения.
+    """
+
+    class Status(TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Формируется'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    user = ForeignKey(
+        to=User,
+        on_delete=CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list_jobs'
+    )
+    file_format = CharField(
+        verbose_name='Формат файла',
+        max_length=10,
+        default='pdf'
+    )
+    status = CharField(
+        verbose_name='Статус',
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    cart_version = PositiveIntegerField(
+        verbose_name='Версия списка покупок',
+        null=True,
+        blank=True
+    )
+    content = BinaryField(
+        verbose_name='Содержимое файла',
+        null=True,
+        editable=False
+    )
+    error = TextField(
+        verbose_name='Ошибка',
+        blank=True
+    )
+    created = DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True
+    )
+    finished = DateTimeField(
+        verbose_name='Дата завершения',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Задача на список покупок'
+        verbose_name_plural = 'Задачи на списки покупок'
+        ordering = ('-created',)
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.file_format}, {self.status}'
+
+
+class ReferenceVersion(Model):
+    """
+    Версия справочника (теги, ингредиенты).
+    Увеличивается при каждом изменении справочника, используется для
+    кэширования и условных запросов (ETag/Last-Modified).
+    """
+    name = CharField(
+        verbose_name='Справочник',
+        max_length=50,
+        unique=True
+    )
+    version = PositiveIntegerField(
+        verbose_name='Версия',
+        default=0
+    )
+    updated = DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+        ordering = ('name',)
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.version}'
+
+
+class FeedEntry(Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан
+    пользователь. Заполняется при публикации рецепта (см. api.utils
+    .feed_fanout) и при подписке; рецепты авторов с числом подписчиков
+    больше settings.FEED_FANOUT_LIMIT в ленту не записываются, а
+    подмешиваются при чтении.
+    """
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='feed',
+        to=User,
+        on_delete=CASCADE,
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    author = ForeignKey(
+        verbose_name='Автор рецепта',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+    )
+    pub_date = DateTimeField(
+        verbose_name='Дата публикации рецепта',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            UniqueConstraint(
+                name='unique_feed_entry',
+                fields=('user', 'recipe'),
+            ),
+        )
+        indexes = (
+            Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx',
+            ),
+            Index(
+                fields=('user', 'author'),
+                name='feed_user_author_idx',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.recipe}'
@@ -0,0 +1,148 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from .models import Ingredient, IngredientAmount, Recipe, ReferenceVersion, Tag
+
+User = get_user_model()
+
+ROWS = 5
+
+
+class AdminChangelistTests(TestCase):
+    """Число запросов списков в админке не зависит от числа строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'
+        )
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                 color='#E26C2D')
+        ingredient = Ingredient.objects.create(name='Тестовая мука',
+                                               measurement_unit='г')
+        for number in range(ROWS):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password'
+            )
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image=f'recipe_images/{number}.jpg'
+            )
+            recipe.tags.add(tag)
+            recipe.favorite.add(cls.admin)
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredients=ingredient, amount=100
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_changelist_queries(self, url_name: str, queries: int):
+        """Список открывается за queries запросов и содержит строки."""
+        url = reverse(url_name)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.context['cl'].result_count, ROWS)
+
+    def test_recipe_changelist(self):
+        self.assert_changelist_queries('admin:recipe_recipe_changelist', 5)
+
+    def test_ingredient_changelist(self):
+        self.assert_changelist_queries('admin:recipe_ingredient_changelist', 4)
+
+    def test_ingredient_amount_changelist(self):
+        self.assert_changelist_queries(
+            'admin:recipe_ingredientamount_changelist', 4
+        )
+
+
+class AdminRecipeVersionTests(TestCase):
+    """
+    Изменение ингредиентов рецепта в админке меняет версию рецепта,
+    поколение кэша рецептов и версию списков покупок с этим рецептом.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                     color='#E26C2D')
+        cls.ingredient = Ingredient.objects.create(name='Тестовая мука',
+                                                   measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe_images/recipe.jpg'
+        )
+        cls.recipe.tags.add(cls.tag)
+        cls.recipe.shopping_cart.add(cls.admin)
+        cls.amount = IngredientAmount.objects.create(
+            recipe=cls.recipe, ingredients=cls.ingredient, amount=100
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def versions(self) -> tuple:
+        return (
+            Recipe.objects.get(id=self.recipe.id).version,
+            ReferenceVersion.objects.get_or_create(name='recipe')[0].version,
+            User.objects.get(id=self.admin.id).cart_version,
+        )
+
+    def assert_versions_bumped(self, url: str, data: dict):
+        before = self.versions()
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        for old, new in zip(before, self.versions()):
+            self.assertGreater(new, old)
+
+    def test_recipe_inline_changed(self):
+        self.assert_versions_bumped(
+            reverse('admin:recipe_recipe_change', args=(self.recipe.id,)),
+            {
+                'name': self.recipe.name,
+                'author': self.admin.id,
+                'tags': [self.tag.id],
+                'cooking_time': self.recipe.cooking_time,
+                'text': self.recipe.text,
+                'ingredient-TOTAL_FORMS': 1,
+                'ingredient-INITIAL_FORMS': 1,
+                'ingredient-0-id': self.amount.id,
+                'ingredient-0-recipe': self.recipe.id,
+                'ingredient-0-ingredients': self.ingredient.id,
+                'ingredient-0-amount': 200,
+            }
+        )
+        self.assertEqual(IngredientAmount.objects.get().amount, 200)
+
+    def test_amount_changed(self):
+        self.assert_versions_bumped(
+            reverse('admin:recipe_ingredientamount_change',
+                    args=(self.amount.id,)),
+            {
+                'recipe': self.recipe.id,
+                'ingredients': self.ingredient.id,
+                'amount': 300,
+            }
+        )
+        self.assertEqual(IngredientAmount.objects.get().amount, 300)
+
+    def test_amount_deleted(self):
+        self.assert_versions_bumped(
+            reverse('admin:recipe_ingredientamount_delete',
+                    args=(self.amount.id,)),
+            {'post': 'yes'}
+        )
+        self.assertFalse(IngredientAmount.objects.exists())
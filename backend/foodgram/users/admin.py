@@ -11,7 +11,9 @@ class FoodgramUserAdmin(UserAdmin):
         'username',
         'email',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count'
     )
     fieldsets = (
         (
@@ -40,8 +42,8 @@ class FoodgramUserAdmin(UserAdmin):
         'email'
     )
     list_filter = (
-        'username',
-        'first_name',
-        'email'
+        'is_active',
+        'is_staff'
     )
+    show_full_result_count = False
     save_on_top = True
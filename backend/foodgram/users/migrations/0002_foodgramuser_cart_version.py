@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='cart_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Меняется при каждом изменении списка покупок', verbose_name='Версия списка покупок'),
+        ),
+    ]
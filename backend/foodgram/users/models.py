@@ -1,6 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db.models import (CharField, CheckConstraint, EmailField,
-                              ManyToManyField, Q)
+                              ManyToManyField, PositiveIntegerField, Q)
 from django.db.models.functions import Length
 from django.utils.translation import gettext_lazy
 
@@ -53,6 +53,22 @@ class FoodgramUser(AbstractUser):
         to='self',
         symmetrical=False
     )
+    cart_version = PositiveIntegerField(
+        verbose_name='Версия списка покупок',
+        help_text='Меняется при каждом изменении списка покупок',
+        default=0,
+        editable=False
+    )
+    recipes_count = PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
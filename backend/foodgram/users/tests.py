@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+User = get_user_model()
+
+ROWS = 5
+
+
+class AdminChangelistTests(TestCase):
+    """Число запросов списка пользователей не зависит от числа строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'
+        )
+        for number in range(ROWS):
+            user = User.objects.create_user(
+                username=f'user{number}',
+                email=f'user{number}@example.com',
+                password='password'
+            )
+            user.subscription.add(cls.admin)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_user_changelist(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse('admin:users_foodgramuser_changelist')
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, ROWS + 1)